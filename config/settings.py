@@ -111,6 +111,7 @@ MIDDLEWARE = [
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "django_extras.cache.CacheMiddleware",
+    "django_extras.state_machine.permissions.PermissionScopeMiddleware",
 ]
 
 
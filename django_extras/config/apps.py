@@ -8,3 +8,12 @@ class DjangoExtrasConfig(AppConfig):
     def ready(self):
         # Ensure signals get registered
         from .. import signals  # noqa
+        from ..state_machine.models import StateMachineModel
+        from ..state_machine.registry import definition_registry
+
+        # Load state machine definitions once per process
+        definition_registry.load()
+        # Install transition methods once models and their transitions are importable
+        for model in self.apps.get_models():
+            if issubclass(model, StateMachineModel):
+                model.install_transition_methods()
@@ -1,3 +1,4 @@
-from accounts.config.models import MODEL_USER
+from accounts.config.models import MODEL_GROUP, MODEL_USER
 
 MODEL_USER = MODEL_USER
+MODEL_GROUP = MODEL_GROUP
@@ -1,16 +1,90 @@
+import asyncio
 import datetime
 import logging
+import os
+import queue
+import random
+import socket
+import threading
 import time
 import uuid
 from abc import abstractmethod
-
-from kombu import Connection, Exchange, Queue
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from django.utils import timezone
+
+from kombu import Connection, Exchange, Queue, pools
+from kombu.compression import get_encoder
+from kombu.exceptions import SerializerNotInstalled
+from kombu.serialization import dumps
 from rest_framework import serializers
 
 from config.settings import AMQP_CONNECTION
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# messages published per acquired producer by `SimpleClient.publish_many`
+PUBLISH_BATCH_SIZE = 100
+# seconds between acknowledgements of processed messages while waiting for messages
+# in the concurrent consumer, see `SimpleClient.consumer_workers`
+ACK_INTERVAL = 0.05
+# reconnection of `SimpleClient.init_consumer`: transient errors are retried
+# `RECONNECT_FAST_RETRIES` times within `RECONNECT_FAST_INTERVAL` seconds, then (as
+# other errors) after exponential intervals with full jitter up to the max interval
+RECONNECT_FAST_RETRIES = 3
+RECONNECT_FAST_INTERVAL = 0.1
+RECONNECT_BASE_INTERVAL = 0.5
+RECONNECT_MAX_INTERVAL = 30
+# serialized bodies of at least this many bytes are compressed, see
+# `SimpleClient.compression`
+COMPRESSION_THRESHOLD = 16 * 1024
+# serializers of the content types decoded by consumers, see `SimpleClient.accept`
+ACCEPT_CONTENT = ("json", "msgpack")
+
+# template connections of the pools, see `get_connection`
+_connections: Dict[Tuple, Connection] = dict()
+
+
+def get_connection(connection_url: str, **transport_options) -> Connection:
+    """Connection shared by clients of `connection_url`, it is never connected but
+    used to acquire producers (and their connections) of the process pools:
+    `kombu.pools.producers[connection].acquire()`. Connections with different
+    transport options are pooled separately."""
+    key = (connection_url, *sorted(transport_options.items()))
+    connection = _connections.get(key)
+    if connection is None:
+        connection = _connections.setdefault(
+            key, Connection(connection_url, transport_options=transport_options)
+        )
+    return connection
+
+
+def _reset_pools_after_fork():
+    # connections of the parent process must not be used (nor closed) by the child,
+    # kombu only clears its pools for `multiprocessing` children.
+    pools.connections.clear()
+    pools.producers.clear()
+
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
 
 class AmqpMetaSerializer(serializers.Serializer):
     correlation_id = serializers.UUIDField()
@@ -24,8 +98,182 @@ class AmqpPublishSerializer(serializers.Serializer):
     body = serializers.JSONField()
 
 
+# fields of `AmqpMetaSerializer` converting values of `AmqpEnvelope`
+_CORRELATION_ID_FIELD = serializers.UUIDField()
+_TIMESTAMP_FIELD = serializers.DateTimeField()
+
+
+@dataclass(frozen=True, slots=True)
+class AmqpEnvelope:
+    """Meta data and body of a published message, built without instantiating
+    serializers. `to_dict` is the representation of `AmqpPublishSerializer` (used
+    by the strict mode of `SimpleClient`) with json types only."""
+
+    body: Any
+    correlation_id: uuid.UUID
+    headers: dict
+    timestamp: datetime.datetime
+    kwargs: dict
+
+    @classmethod
+    def build(
+        cls,
+        body,
+        correlation_id=None,
+        headers: dict = None,
+        timestamp: datetime.datetime = None,
+        kwargs: dict = None,
+    ) -> "AmqpEnvelope":
+        """Raises `serializers.ValidationError` if the correlation id or timestamp are
+        not valid, the body is only encoded when published."""
+        if correlation_id is None:
+            correlation_id = uuid.uuid4()
+        elif not isinstance(correlation_id, uuid.UUID):
+            correlation_id = _CORRELATION_ID_FIELD.to_internal_value(correlation_id)
+        if timestamp is None:
+            timestamp = timezone.now()
+        elif not isinstance(timestamp, datetime.datetime):
+            timestamp = _TIMESTAMP_FIELD.to_internal_value(timestamp)
+        return cls(body, correlation_id, headers or {}, timestamp, kwargs or {})
+
+    def to_dict(self) -> dict:
+        return {
+            "meta": {
+                "correlation_id": str(self.correlation_id),
+                "headers": self.headers,
+                "timestamp": _TIMESTAMP_FIELD.to_representation(self.timestamp),
+                "kwargs": self.kwargs,
+            },
+            "body": self.body,
+        }
+
+
+@dataclass
+class PublishFailure:
+    """A message `SimpleClient.publish_many` failed to validate or publish"""
+
+    index: int
+    message: dict
+    error: Exception
+
+
+@dataclass
+class ConsumerStats:
+    """Connection counters of a consumer, see `SimpleClient.init_consumer`"""
+
+    # connections established after a connection error
+    reconnects: int = 0
+    connection_errors: int = 0
+    # time.monotonic() of the last connection error while not connected yet
+    disconnected_since: Optional[float] = None
+    _disconnected_seconds: float = 0.0
+
+    @property
+    def disconnected_seconds(self) -> float:
+        """Seconds spent disconnected after connection errors, current included"""
+        if self.disconnected_since is None:
+            return self._disconnected_seconds
+        return self._disconnected_seconds + time.monotonic() - self.disconnected_since
+
+    def disconnected(self):
+        self.connection_errors += 1
+        if self.disconnected_since is None:
+            self.disconnected_since = time.monotonic()
+
+    def connected(self):
+        if self.disconnected_since is not None:
+            self._disconnected_seconds = self.disconnected_seconds
+            self.disconnected_since = None
+            self.reconnects += 1
+
+
+class AckBatcher:
+    """Acknowledges messages processed by worker threads from the thread of their
+    connection, in delivery order.
+
+    Processed messages are acknowledged once `batch_size` of them completed (or
+    on `flush(force=True)`), messages processed before an earlier delivered message
+    wait for it. With `multiple` a run of successful messages is acknowledged at
+    once (AMQP `basic.ack` with `multiple`), failed messages are rejected.
+    """
+
+    def __init__(self, batch_size: int = 1, multiple: bool = False):
+        self.batch_size = batch_size
+        self.multiple = multiple
+        # delivered messages not acknowledged yet, in delivery order
+        self._pending: Dict[int, Any] = dict()
+        self._results: Dict[int, bool] = dict()
+        self._done = queue.SimpleQueue()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, message):
+        self._pending[message.delivery_tag] = message
+
+    def done(self, message, success: bool):
+        """Mark a message as processed, called from worker threads"""
+        self._done.put((message.delivery_tag, success))
+
+    def flush(self, force: bool = False) -> int:
+        """Acknowledge processed messages, returns the number of acknowledged"""
+        while True:
+            try:
+                delivery_tag, success = self._done.get_nowait()
+            except queue.Empty:
+                break
+            self._results[delivery_tag] = success
+        if not self._results or (not force and len(self._results) < self.batch_size):
+            return 0
+
+        acknowledged = 0
+        last = None
+        for delivery_tag, message in list(self._pending.items()):
+            success = self._results.pop(delivery_tag, None)
+            if success is None:
+                break
+            del self._pending[delivery_tag]
+            if success and self.multiple:
+                last = message
+            elif success:
+                message.ack()
+            else:
+                if last is not None:
+                    last.ack(multiple=True)
+                    last = None
+                message.reject(requeue=False)
+                continue
+            acknowledged += 1
+        if last is not None:
+            last.ack(multiple=True)
+        return acknowledged
+
+
 class SimpleClient:
-    """A simple synchronous rabbitmq-kombu client interface."""
+    """A simple synchronous rabbitmq-kombu client interface.
+
+    Messages are published with producers of the process pools, connections are
+    kept open and shared by clients with the same connection url. Envelopes are
+    built with `AmqpEnvelope`, in `strict` mode they are validated by
+    `AmqpPublishSerializer` instead.
+
+    With `consumer_workers` messages are consumed concurrently: `on_message` runs
+    in a pool of threads and must not acknowledge messages, they are acknowledged
+    (in batches of `ack_batch_size`) once it returns and rejected if it raises.
+    Messages of the same routing key are processed in order unless `ordered` is
+    False. At most `prefetch_count` messages are delivered before they are
+    acknowledged, dead connections are detected within `drain_timeout` seconds
+    (or missed `heartbeat`).
+
+    The exchange, queue and binding are declared on the first connection of the
+    consumer only, reconnections (see `reconnect_interval`) are counted by `stats`.
+
+    Bodies are serialized with the kombu serializer `body_serializer` (e.g. json,
+    msgpack) or "orjson", which publishes json too. Bodies of at least
+    `compression_threshold` bytes are compressed with `compression` (e.g. gzip,
+    zstd). Consumers decode messages by their content type and compression header,
+    content types of the `accept` serializers only.
+    """
 
     def __init__(
         self,
@@ -36,9 +284,40 @@ class SimpleClient:
         exchange_type: str = "topic",
         queue_name: str = None,
         routing_key: str = None,
+        strict: bool = False,
+        consumer_workers: int = 0,
+        prefetch_count: int = None,
+        ordered: bool = True,
+        ack_batch_size: int = 1,
+        drain_timeout: float = 1.0,
+        heartbeat: float = None,
+        body_serializer: str = "json",
+        compression: str = None,
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+        accept: Sequence[str] = ACCEPT_CONTENT,
         **kwargs,
     ):
         self.connection_url = connection_url or AMQP_CONNECTION
+        self.strict = strict
+        self.consumer_workers = consumer_workers
+        self.prefetch_count = prefetch_count
+        self.ordered = ordered
+        self.ack_batch_size = ack_batch_size
+        if prefetch_count:
+            # acknowledgements must not wait for messages which are not delivered
+            self.ack_batch_size = min(ack_batch_size, prefetch_count)
+        self.drain_timeout = drain_timeout
+        self.heartbeat = heartbeat
+        self.body_serializer = body_serializer
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.accept = accept
+        self._check_body_format()
+        self._stop_consuming = threading.Event()
+        self.stats = ConsumerStats()
+        self._reconnect_attempt = 0
+        # the queue (its exchange and binding) is declared by the broker
+        self._declared = False
         self.exchange_name = exchange_name
         self.topics = topics
         self.routing_key = routing_key
@@ -46,6 +325,7 @@ class SimpleClient:
         if topics is None:
             self.topics = f"{self.exchange_name}.*"
         self.exchange_type = exchange_type
+        self.exchange = Exchange(self.exchange_name, type=self.exchange_type)
         self.queue_name = queue_name
         if queue_name is None:
             self.queue_name = (
@@ -54,6 +334,11 @@ class SimpleClient:
                 f"{self.exchange_name}-"
                 f"{self.topics}-"
             )
+        self.queue = Queue(self.queue_name, self.exchange, routing_key=self.topics)
+
+    @property
+    def connection(self) -> Connection:
+        return get_connection(self.connection_url)
 
     def _connect_consumer(self):
         """Connect to Rabbitmq queue given configuration params.
@@ -61,41 +346,160 @@ class SimpleClient:
         -------
 
         """
+        if self.consumer_workers:
+            self._connect_concurrent_consumer()
+            return
         with Connection(self.connection_url) as conn:
-            # Create an exchange
-            exchange = Exchange(self.exchange_name, type=self.exchange_type)
-            # Create a queue
-            queue = Queue(self.queue_name, exchange, routing_key=self.topics)
-            # Bind the queue to the exchange
-            queue.bind(conn)
-
             # Subscribe to the queue
-            with conn.Consumer(queue, callbacks=[self.on_message]):
+            with self._consumer(conn, callbacks=[self.on_message]):
+                self._consumer_connected()
                 # Process messages
-                while True:
+                while not self._stop_consuming.is_set():
                     conn.drain_events()
 
+    def _connect_concurrent_consumer(self):
+        """Consume messages with `on_message` running in worker threads, the
+        connection (and acknowledgements) stay in the calling thread."""
+        if self.ordered:
+            # messages of a routing key are always processed by the same thread
+            executors = [
+                ThreadPoolExecutor(max_workers=1) for _ in range(self.consumer_workers)
+            ]
+        else:
+            executors = [ThreadPoolExecutor(max_workers=self.consumer_workers)]
+        graceful = False
+
+        with Connection(self.connection_url, heartbeat=self.heartbeat) as conn:
+            acks = AckBatcher(
+                self.ack_batch_size, multiple=conn.transport.driver_type == "amqp"
+            )
+
+            def dispatch(body, message):
+                acks.add(message)
+                routing_key = message.delivery_info.get("routing_key")
+                executor = executors[hash(routing_key) % len(executors)]
+                executor.submit(self._handle_message, acks, body, message)
+
+            try:
+                with self._consumer(
+                    conn, callbacks=[dispatch], prefetch_count=self.prefetch_count
+                ):
+                    self._consumer_connected()
+                    while not self._stop_consuming.is_set():
+                        try:
+                            # poll acknowledgements while messages are processed
+                            conn.drain_events(
+                                timeout=(
+                                    ACK_INTERVAL if len(acks) else self.drain_timeout
+                                )
+                            )
+                        except socket.timeout:
+                            conn.heartbeat_check()
+                            acks.flush(force=True)
+                        else:
+                            acks.flush()
+                    # stopped, acknowledge messages being processed
+                    for executor in executors:
+                        executor.shutdown(wait=True)
+                    acks.flush(force=True)
+                    graceful = True
+            finally:
+                if not graceful:
+                    # unacknowledged messages are delivered again
+                    for executor in executors:
+                        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _check_body_format(self):
+        if self.body_serializer == "orjson" and orjson is None:
+            raise ValueError("Serializer 'orjson' requires the orjson package")
+        try:
+            self.encode({})
+        except SerializerNotInstalled as e:
+            raise ValueError(str(e)) from e
+        if self.compression is not None:
+            try:
+                get_encoder(self.compression)
+            except KeyError:
+                raise ValueError(
+                    f"Compression '{self.compression}' is not available, e.g. "
+                    "zstd requires the zstandard package"
+                )
+
+    def _consumer(self, conn: Connection, **kwargs):
+        """Consumer of the queue, declared (with its exchange and binding) unless it
+        was declared by an earlier connection of the consumer"""
+        consumer = conn.Consumer(
+            self.queue, auto_declare=not self._declared, accept=self.accept, **kwargs
+        )
+        self._declared = True
+        return consumer
+
+    def _consumer_connected(self):
+        self._reconnect_attempt = 0
+        self.stats.connected()
+
+    def reconnect_interval(self, attempt: int, transient: bool) -> float:
+        """Seconds to wait before reconnection `attempt` (from 0) of the consumer"""
+        if transient and attempt < RECONNECT_FAST_RETRIES:
+            return random.uniform(0, RECONNECT_FAST_INTERVAL)
+        if transient:
+            attempt -= RECONNECT_FAST_RETRIES
+        # full jitter spreads reconnections of consumers disconnected together
+        return random.uniform(
+            0, min(RECONNECT_MAX_INTERVAL, RECONNECT_BASE_INTERVAL * 2**attempt)
+        )
+
+    def _handle_message(self, acks: AckBatcher, body, message):
+        try:
+            self.on_message(body, message)
+        except Exception as e:
+            logger.exception(msg=f"[MESSAGE FAILED] {e}")
+            acks.done(message, False)
+        else:
+            acks.done(message, True)
+
     def init_consumer(self, raise_exception=False):
         """Initialize connection to Rabbitmq
         Parameters
         ----------
-        raise_exception: If false, will keep retrying to connect on any error
-        every 5 s
+        raise_exception: If false, will keep retrying to connect on any error,
+        see `reconnect_interval`
 
         Returns
         -------
 
         """
+        self._stop_consuming.clear()
         if raise_exception:
             self._connect_consumer()
             return
-        while True:
+        connection = self.connection
+        transient_errors = (
+            connection.recoverable_connection_errors
+            + connection.recoverable_channel_errors
+        )
+        while not self._stop_consuming.is_set():
             try:
                 self._connect_consumer()
             except Exception as e:
-                err = f"[CRITICAL] [CONNECTION BROKEN] {e}"
-                logger.info(msg=err)
-                time.sleep(5)
+                self.stats.disconnected()
+                if isinstance(e, connection.channel_errors):
+                    # e.g. the queue was deleted
+                    self._declared = False
+                interval = self.reconnect_interval(
+                    self._reconnect_attempt, isinstance(e, transient_errors)
+                )
+                self._reconnect_attempt += 1
+                err = (
+                    f"[CRITICAL] [CONNECTION BROKEN] {e}, reconnect in {interval:.2f}s"
+                )
+                logger.warning(msg=err)
+                self._stop_consuming.wait(interval)
+
+    def stop_consumer(self):
+        """Stop consuming once the current wait for messages returns, messages being
+        processed by workers are acknowledged first."""
+        self._stop_consuming.set()
 
     def publish(
         self,
@@ -121,6 +525,24 @@ class SimpleClient:
         -------
 
         """
+        body = self.envelope(
+            message,
+            correlation_id=correlation_id,
+            headers=headers,
+            timestamp=timestamp,
+            serializer=serializer,
+        )
+        self.send(body, routing_key=routing_key, headers=headers)
+
+    def envelope(
+        self,
+        message: dict,
+        correlation_id=None,
+        headers: dict = None,
+        timestamp: datetime.datetime = None,
+        serializer: serializers.Serializer.__class__ = None,
+    ) -> dict:
+        """Validate a message and wrap it with its meta data, see `publish`"""
         # the kwargs are used in the unit tests
         # so they are added to the message meta
         # to avoid unexpected data to be passed
@@ -134,6 +556,11 @@ class SimpleClient:
             serializer.is_valid(raise_exception=True)
             message = serializer.data
 
+        if not self.strict:
+            return AmqpEnvelope.build(
+                message, correlation_id, headers, timestamp, message_kwargs
+            ).to_dict()
+
         # Add meta data for debugging messages
         meta_data = {
             "correlation_id": correlation_id or uuid.uuid4(),
@@ -148,18 +575,100 @@ class SimpleClient:
             }
         )
         amqp_message.is_valid(raise_exception=True)
+        return amqp_message.data
 
-        # finally, connect and publish a message
-        with Connection(self.connection_url) as conn:
-            exchange = Exchange(self.exchange_name, type=self.exchange_type)
-            producer = conn.Producer(exchange=exchange, serializer="json")
-            producer.publish(
-                body=amqp_message.data,
-                routing_key=routing_key or self.routing_key,
-                retry=True,
-                headers=headers,
+    def publish_many(
+        self,
+        messages: List[dict],
+        routing_key: str = None,
+        headers: dict = None,
+        serializer: serializers.Serializer.__class__ = None,
+        batch_size: int = PUBLISH_BATCH_SIZE,
+        confirm: bool = True,
+    ) -> List[PublishFailure]:
+        """Publish messages to Rabbitmq exchange, on one channel per batch of
+        `batch_size` messages. Messages failing to validate or publish do not stop
+        the others, they are reported instead.
+
+        Parameters
+        ----------
+        messages: messages to publish
+        routing_key: str
+        headers : Dict
+        serializer: serializers.Serializer.__class__
+        batch_size: messages published per acquired producer
+        confirm: wait for the broker to confirm each message (publisher confirms),
+        a nacked message fails with `amqp.exceptions.MessageNacked`
+
+        Returns
+        -------
+        List[PublishFailure]: failed messages, in order
+        """
+        failures: List[PublishFailure] = []
+        bodies: List[Tuple[int, dict]] = []
+        for index, message in enumerate(messages):
+            try:
+                body = self.envelope(message, headers=headers, serializer=serializer)
+            except serializers.ValidationError as e:
+                failures.append(PublishFailure(index, message, e))
+                continue
+            bodies.append((index, body))
+
+        connection = (
+            get_connection(self.connection_url, confirm_publish=True)
+            if confirm
+            else self.connection
+        )
+        for i in range(0, len(bodies), batch_size):
+            with pools.producers[connection].acquire(block=True) as producer:
+                for index, body in bodies[i : i + batch_size]:
+                    try:
+                        self._publish(producer, body, routing_key, headers)
+                    except Exception as e:
+                        logger.warning(msg=f"[PUBLISH FAILED] {index}: {e}")
+                        failures.append(PublishFailure(index, messages[index], e))
+        failures.sort(key=lambda failure: failure.index)
+        return failures
+
+    def send(self, body: dict, routing_key: str = None, headers: dict = None):
+        """Publish an enveloped message with a pooled producer"""
+        with pools.producers[self.connection].acquire(block=True) as producer:
+            self._publish(producer, body, routing_key, headers)
+
+    def encode(self, body: dict) -> Tuple[bytes, str, str, Optional[str]]:
+        """Serialize an enveloped message with `body_serializer`, returns the
+        payload, its content type and encoding, and the compression to apply"""
+        if self.body_serializer == "orjson":
+            payload, content_type, content_encoding = (
+                orjson.dumps(body),
+                "application/json",
+                "utf-8",
             )
-            conn.close()
+        else:
+            content_type, content_encoding, payload = dumps(body, self.body_serializer)
+            if isinstance(payload, str):
+                payload = payload.encode(content_encoding)
+        if self.compression is None or len(payload) < self.compression_threshold:
+            return payload, content_type, content_encoding, None
+        return payload, content_type, content_encoding, self.compression
+
+    def _publish(
+        self, producer, body: dict, routing_key: str = None, headers: dict = None
+    ):
+        payload, content_type, content_encoding, compression = self.encode(body)
+        # the exchange is declared once per connection
+        producer.publish(
+            body=payload,
+            exchange=self.exchange,
+            routing_key=routing_key or self.routing_key,
+            content_type=content_type,
+            content_encoding=content_encoding,
+            compression=compression,
+            retry=True,
+            declare=[self.exchange],
+            # the compression is added to the headers
+            headers=dict(headers or {}),
+        )
 
     @staticmethod
     @abstractmethod
@@ -167,6 +676,163 @@ class SimpleClient:
         pass
 
 
+@dataclass
+class AsyncMessage:
+    """A message delivered by `AsyncSimpleClient.consume`. It is acknowledged (or
+    rejected) by the consumer thread of its connection, in delivery order."""
+
+    body: Any
+    message: Any = field(repr=False)
+    _acks: AckBatcher = field(repr=False)
+
+    @property
+    def routing_key(self) -> str:
+        return self.message.delivery_info.get("routing_key")
+
+    def ack(self):
+        self._acks.done(self.message, True)
+
+    def reject(self):
+        self._acks.done(self.message, False)
+
+
+class AsyncSimpleClient(SimpleClient):
+    """An asyncio rabbitmq-kombu client interface, with the exchange, topic and
+    queue naming and the envelopes of `SimpleClient`.
+
+    kombu is synchronous: messages are published with the pooled producers in
+    threads of the default executor, and the queue is consumed by a thread
+    delivering messages to the event loop, so the loop is never blocked.
+    """
+
+    async def publish(
+        self,
+        message: dict,
+        routing_key: str = None,
+        correlation_id=None,
+        headers: dict = None,
+        timestamp: datetime.datetime = None,
+        serializer: serializers.Serializer.__class__ = None,
+    ):
+        """Publish message to Rabbitmq exchange, see `SimpleClient.publish`"""
+        body = self.envelope(
+            message,
+            correlation_id=correlation_id,
+            headers=headers,
+            timestamp=timestamp,
+            serializer=serializer,
+        )
+        await asyncio.to_thread(
+            self.send, body, routing_key=routing_key, headers=headers
+        )
+
+    async def publish_many(
+        self, messages: List[dict], **kwargs
+    ) -> List[PublishFailure]:
+        """Publish messages to Rabbitmq exchange, see `SimpleClient.publish_many`"""
+        return await asyncio.to_thread(super().publish_many, messages, **kwargs)
+
+    async def consume(self, concurrency: int = 10) -> AsyncIterator[AsyncMessage]:
+        """Iterate messages of the queue, every message must be acknowledged or
+        rejected. At most `concurrency` messages are delivered before they are,
+        e.g. while they are processed by tasks. Close the iterator (see
+        `contextlib.aclosing`) to stop consuming, unacknowledged messages are then
+        delivered again.
+        """
+        loop = asyncio.get_running_loop()
+        messages: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._consume_in_thread,
+            args=(loop, messages, stop, concurrency),
+            daemon=True,
+        )
+        thread.start()
+        try:
+            while True:
+                message = await messages.get()
+                if isinstance(message, Exception):
+                    raise message
+                yield message
+        finally:
+            stop.set()
+            await asyncio.to_thread(thread.join)
+
+    async def consume_with(
+        self,
+        handler: Callable[[Any, AsyncMessage], Awaitable],
+        concurrency: int = 10,
+    ):
+        """Process messages of the queue with up to `concurrency` concurrent calls
+        of `handler(body, message)` until cancelled. Messages are acknowledged once
+        handled and rejected if `handler` raises."""
+
+        async def handle(message: AsyncMessage):
+            try:
+                await handler(message.body, message)
+            except Exception as e:
+                logger.exception(msg=f"[MESSAGE FAILED] {e}")
+                message.reject()
+            else:
+                message.ack()
+
+        tasks = set()
+        consumer = self.consume(concurrency)
+        try:
+            async for message in consumer:
+                task = asyncio.create_task(handle(message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            await consumer.aclose()
+            for task in tasks:
+                task.cancel()
+
+    def _consume_in_thread(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        messages: asyncio.Queue,
+        stop: threading.Event,
+        concurrency: int,
+    ):
+        def put(item):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(messages.put_nowait, item)
+
+        try:
+            with Connection(self.connection_url, heartbeat=self.heartbeat) as conn:
+                acks = AckBatcher(multiple=conn.transport.driver_type == "amqp")
+
+                def deliver(body, message):
+                    acks.add(message)
+                    put(AsyncMessage(body, message, acks))
+
+                with self._consumer(
+                    conn, callbacks=[deliver], prefetch_count=concurrency
+                ):
+                    self._consumer_connected()
+                    while not stop.is_set():
+                        acks.flush(force=True)
+                        if len(acks) >= concurrency:
+                            # transports without QoS deliver beyond the prefetch
+                            conn.heartbeat_check()
+                            time.sleep(ACK_INTERVAL)
+                            continue
+                        try:
+                            conn.drain_events(
+                                timeout=(
+                                    ACK_INTERVAL if len(acks) else self.drain_timeout
+                                )
+                            )
+                        except socket.timeout:
+                            conn.heartbeat_check()
+                    acks.flush(force=True)
+        except Exception as e:
+            err = f"[CRITICAL] [CONNECTION BROKEN] {e}"
+            logger.info(msg=err)
+            put(e)
+
+
 class CeleryTaskRunner:
     """Runs a list of shared tasks with arguments provided to call function.
     Results are interpreted by on_success and on_error methods.
@@ -0,0 +1,41 @@
+from django.db.models.signals import m2m_changed, post_delete
+from django.dispatch import receiver
+
+from django_extras.config.models_foreign import MODEL_GROUP, MODEL_USER
+from django_extras.state_machine.permissions import invalidate_permission_version
+
+PERMISSION_CHANGE_ACTIONS = {"post_add", "post_remove", "post_clear"}
+
+
+@receiver(m2m_changed, dispatch_uid="invalidate_transition_permissions")
+def invalidate_transition_permissions(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """Invalidate cached transition permissions (see `Transitions.transitions_api`)
+    when group or permission memberships change."""
+    if action not in PERMISSION_CHANGE_ACTIONS:
+        return
+    if sender is MODEL_GROUP.instance.permissions.through:
+        invalidate_permission_version()
+        return
+    user_model = MODEL_USER.instance
+    if sender not in {
+        getattr(user_model, field).through
+        for field in ("groups", "user_permissions")
+        if hasattr(user_model, field)
+    }:
+        return
+    if not reverse:
+        invalidate_permission_version([instance.pk])
+    else:
+        # users of a group or permission, every user when cleared
+        invalidate_permission_version(pk_set)
+
+
+@receiver(
+    post_delete,
+    sender=MODEL_GROUP.ref,
+    dispatch_uid="invalidate_transition_permissions_on_group_delete",
+)
+def invalidate_transition_permissions_on_group_delete(sender, **kwargs):
+    invalidate_permission_version()
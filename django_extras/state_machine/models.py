@@ -1,27 +1,58 @@
 from __future__ import annotations
 
+import copy
+import dataclasses
 import json
-import os
-from copy import deepcopy
+import operator
+from collections import defaultdict
 from enum import Enum
-from functools import cached_property
+from functools import cached_property, partial, reduce
 from pydoc import locate
-from typing import Callable, Dict, List, Set, Type, Union
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 from django.conf import settings
-from django.db import models
-from django.db.models import Model, Q
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.postgres.fields import ArrayField
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import DEFERRED, Case, Model, Q, Value, When
 from django.dispatch import Signal
 
 from transitions import EventData, MachineError
 
 from django_extras.celery import default_shared_task
+from django_extras.class_ref import ClassRef
 from django_extras.config.models_foreign import MODEL_USER
+from django_extras.state_machine import outbox
+from django_extras.state_machine.permissions import (
+    CACHE_KEY_TRANSITIONS_API,
+    GLOBAL_PERMISSION_PREFIX,
+    get_permission_resolver,
+    get_permission_version,
+    get_user_permission_codenames,
+)
+from django_extras.state_machine.registry import definition_registry, machine_registry
 from django_extras.state_machine.utils import (
     DynamicallyNamedMachine,
     TransitionWithMeta,
 )
 
+# entities transitioned per transaction by `bulk_transition_in_batches`
+BULK_TRANSITION_BATCH_SIZE = 500
+
 
 class Transitions(Enum):
     # store transitions and transitions_api for fast lookup
@@ -63,6 +94,7 @@ class Transitions(Enum):
         """
         Parameters
         ----------
+        user restricts transitions to the ones the user has the permission of
         as_sorted_list returns sorted list of api formatted transition names
         as_str return sorted str with specified delimter e.g. ', '.join(sorted(...))
         """
@@ -87,31 +119,70 @@ class Transitions(Enum):
                 if v.value not in cls._transitions_private()
             }
 
+        transitions_api = cls._transitions_api
+        if user is not None:
+            transitions_api = cls._user_transitions_api(user)
+
         if as_sorted_list or as_str is not None:
             transitions = sorted(
                 cls.transitions() - cls._transitions_private()
-                if cls._depreciated()
-                else cls._transitions_api.keys()
+                if cls._depreciated() and user is None
+                else transitions_api.keys()
             )
             if as_str is not None:
                 return as_str.join(transitions)
             return transitions
-        return (
-            cls._transitions_api if user is None else None
-        )  # please replace with actual user handling logic
+        return transitions_api
+
+    @classmethod
+    def _user_transitions_api(cls, user) -> Dict[str, str]:
+        """`_transitions_api` restricted to the transitions `user` has the permission
+        of (see `get_transition_permissions`), cached per permission version."""
+        if getattr(user, "is_active", True) and getattr(user, "is_superuser", False):
+            return cls._transitions_api
+        key = (
+            f"{CACHE_KEY_TRANSITIONS_API}{cls.__module__}.{cls.__qualname__}:"
+            f"{user.pk}:{get_permission_version(user)}"
+        )
+        transitions_api = cache.get(key)
+        if transitions_api is None:
+            codenames = get_user_permission_codenames(user)
+            transitions_api = {
+                name: transition
+                for name, transition in cls._transitions_api.items()
+                if not cls.get_transition_permissions({transition}).isdisjoint(
+                    codenames
+                )
+            }
+            cache.set(key, transitions_api)
+        return transitions_api
 
 
 class StateMachineDefinition:
-    """Takes care of loading a state machine based from its directory given an entity"""
+    """Takes care of loading a state machine based from its directory given an entity
+
+    The definition is compiled into immutable lookup tables answering structural
+    questions without a machine:
+        state_triggers: state -> triggers available from the state
+        destinations: (trigger, source) -> destination state
+        trigger_sources: trigger -> states the trigger is available from
+        trigger_meta: trigger -> meta, e.g. permissions
+    """
 
     _transitions_set: Set[str]
+    states: FrozenSet[str]
+    state_triggers: Mapping[str, Tuple[str, ...]]
+    destinations: Mapping[Tuple[str, str], str]
+    trigger_sources: Mapping[str, FrozenSet[str]]
+    trigger_meta: Mapping[str, Mapping]
 
     def __init__(self, entity, path=None):
         self._path_definition = path
         if path is None:
             self._path_definition = self.get_state_machine_path(entity)
-        with open(f"{path}/definition.json", "r") as f:
+        with open(f"{self._path_definition}/definition.json", "r") as f:
             self.definition = json.load(f)
+        self._compile()
         self._path_module = self.to_module_path(self._path_definition)
         self.background_actions_module = locate(
             f"{self._path_module}.background_actions"
@@ -120,6 +191,10 @@ class StateMachineDefinition:
             f"{self._path_module}.synchronous_actions"
         )
 
+    @property
+    def path(self) -> str:
+        return self._path_definition
+
     @property
     def transitions_set(self) -> Set[str]:
         if not hasattr(self, "_transitions_set"):
@@ -128,6 +203,53 @@ class StateMachineDefinition:
             }
         return self._transitions_set
 
+    def _compile(self):
+        """Compile the lookup tables of the definition"""
+        states = [
+            state["name"] if isinstance(state, dict) else state
+            for state in self.definition.get("states", [])
+        ]
+        state_triggers: Dict[str, List[str]] = {state: [] for state in states}
+        destinations: Dict[Tuple[str, str], str] = dict()
+        trigger_meta: Dict[str, Mapping] = dict()
+        for transition in self.definition.get("transitions", []):
+            trigger = transition["trigger"]
+            sources = transition["source"]
+            if sources == "*":
+                sources = states
+            elif isinstance(sources, str):
+                sources = [sources]
+            for source in sources:
+                dest = transition.get("dest")
+                # reflexive (=) and internal (None) transitions stay in the source
+                destinations.setdefault(
+                    (trigger, source), source if dest in ("=", None) else dest
+                )
+                if trigger not in state_triggers.setdefault(source, []):
+                    state_triggers[source].append(trigger)
+            trigger_meta.setdefault(
+                trigger, MappingProxyType(transition.get("meta", dict()))
+            )
+        self.states = frozenset(states)
+        self.state_triggers = MappingProxyType(
+            {state: tuple(triggers) for state, triggers in state_triggers.items()}
+        )
+        self.destinations = MappingProxyType(destinations)
+        trigger_sources: Dict[str, Set[str]] = dict()
+        for trigger, source in destinations:
+            trigger_sources.setdefault(trigger, set()).add(source)
+        self.trigger_sources = MappingProxyType(
+            {
+                trigger: frozenset(sources)
+                for trigger, sources in trigger_sources.items()
+            }
+        )
+        self.trigger_meta = MappingProxyType(trigger_meta)
+
+    def get_destination(self, trigger: str, source: str) -> Union[str, None]:
+        """Destination of `trigger` from `source`, None if it is not valid"""
+        return self.destinations.get((trigger, source))
+
     @staticmethod
     def to_module_path(state_machine_path):
         """
@@ -143,51 +265,220 @@ class StateMachineDefinition:
         return ".".join(state_machine_path.split("/")[-3:])
 
     @staticmethod
-    def get_state_machine_path(entity, default=False):
-        base_path = (
-            f"{settings.ROOT_DIR}/{entity.__class__._meta.app_label}/state_machine/"
-            f"{entity.__class__._meta.verbose_name.lower()}_"
+    def get_state_machine_base_path(model: Type[Model]) -> str:
+        """{ROOT_DIR}/{app_label}/state_machine/{state_machine_name}_"""
+        return (
+            f"{settings.ROOT_DIR}/{model._meta.app_label}/state_machine/"
+            f"{model._meta.verbose_name.lower()}_"
         )
+
+    @staticmethod
+    def get_state_machine_path(entity, default=False):
+        base_path = StateMachineDefinition.get_state_machine_base_path(entity.__class__)
         if default:
             return f"{base_path}default"
         machine_type = getattr(entity, "type", "default")
         if hasattr(entity, "type_id"):
             machine_type = entity.type_id
-        path = f"{base_path}{machine_type}"
-        # avoid isfile check
-        if path in entity._machine_definition:
-            return path
-        if not os.path.isdir(path):
-            path = f"{base_path}default"
-            # avoid isfile check
-            if path in entity._machine_definition:
-                return path
-            if not os.path.isdir(path):
-                raise MachineError(f"Path does not exist: {path}")
-        return path
+        return definition_registry.resolve_path(base_path, machine_type)
 
     def __hash__(self):
-        return self.path
+        return hash(self.path)
 
     def __eq__(self, other):
         return self.path == other.path
 
 
-#
-# @dataclasses.dataclass
-# class EventSignalKwargs:
-#     sender: StateMachineModel.__class__  # event_data.model.__class__,
-#     instance: StateMachineModel
-#     entity_id: str
-#     source: EventData.transition
-#     target: transition.dest,
-#     transition: transition_dict,
-#     transition_name: event_data.event.name,
-#     request_user_id: event_data.kwargs.pop("user_id", None),
-#     data: event_data.kwargs.get("payload") or {},
-#     kwargs: event_data.kwargs or {},
-#
-#
+class TransitionConflict(MachineError):
+    """The entity was modified concurrently, see `transition_compare_and_swap`"""
+
+
+@dataclasses.dataclass
+class TransitionResult:
+    """Result of transitioning an entity in `StateMachineModel.bulk_transition`"""
+
+    CONFLICT = "conflict"
+    DENIED = "denied"
+
+    entity_id: str
+    success: bool
+    source: str = None
+    target: str = None
+    # CONFLICT if the trigger is not valid from the entity's state, DENIED if a
+    # condition or permission check failed.
+    error: str = None
+    detail: str = None
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class TransitionEvent:
+    """A successful transition of an entity, sent as `event` with `post_transition`.
+
+    The transition is referenced rather than copied, as machines are shared between
+    entities it must not be modified.
+    """
+
+    sender: Type[StateMachineModel]
+    instance: StateMachineModel
+    entity_id: str
+    source: str
+    target: str
+    transition: TransitionWithMeta
+    transition_name: str
+    request_user_id: Any = None
+    data: Dict = dataclasses.field(default_factory=dict)
+    kwargs: Dict = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def from_event_data(cls, event_data: EventData) -> TransitionEvent:
+        transition = event_data.transition
+        return cls(
+            sender=event_data.model.__class__,
+            instance=event_data.model,
+            entity_id=str(event_data.model.id),
+            source=transition.source,
+            target=transition.dest,
+            transition=transition,
+            transition_name=event_data.event.name,
+            request_user_id=event_data.kwargs.pop("user_id", None),
+            data=event_data.kwargs.get("payload") or {},
+            kwargs=event_data.kwargs or {},
+        )
+
+    @property
+    def transition_dict(self) -> Dict:
+        """Copy of the attributes of the transition, except its conditions"""
+        return copy.deepcopy(
+            {k: v for k, v in vars(self.transition).items() if k != "conditions"}
+        )
+
+    def signal_kwargs(self) -> Dict:
+        """Keyword arguments of `post_transition` (and synchronous actions), the
+        event itself is passed as `event`."""
+        return {
+            "sender": self.sender,
+            "instance": self.instance,
+            "entity_id": self.entity_id,
+            "source": self.source,
+            "target": self.target,
+            "transition": self.transition_dict,
+            "transition_name": self.transition_name,
+            "request_user_id": self.request_user_id,
+            "data": self.data,
+            "kwargs": self.kwargs,
+            "event": self,
+        }
+
+    def __getitem__(self, key: str):
+        # events used to be dictionaries of the signal kwargs, e.g. in
+        # `post_bulk_transition`
+        if key == "transition":
+            return self.transition_dict
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+
+class StateMachineQuerySet(models.QuerySet):
+    """
+    Filters entities on the structure of their state machine definitions in SQL,
+    the source states of triggers of each definition (per entity type) are compiled
+    into `WHERE` conditions and `CASE` annotations. Conditions and permissions are
+    only checked on transition.
+    """
+
+    def _definition_conditions(self) -> List[Tuple[Q, StateMachineDefinition]]:
+        """Condition on the entity type selecting each definition of the model"""
+        definitions = definition_registry.get_by_type(
+            StateMachineDefinition.get_state_machine_base_path(self.model)
+        )
+        default = definitions.pop("default", None)
+        # see `StateMachineDefinition.get_state_machine_path`
+        type_field = next(
+            (
+                field
+                for attname in ("type_id", "type")
+                for field in self.model._meta.concrete_fields
+                if field.attname == attname
+            ),
+            None,
+        )
+        if type_field is None:
+            return [] if default is None else [(Q(), default)]
+        # the base path prefix also matches definitions of other models sharing
+        # the name prefix (e.g. `task_` and `task_template_default`), keep only
+        # the ones whose type is a valid value of the type field
+        machine_types = {}
+        for machine_type, definition in definitions.items():
+            try:
+                machine_types[type_field.to_python(machine_type)] = definition
+            except (ValidationError, ValueError):
+                continue
+        conditions = [
+            (Q(**{type_field.attname: machine_type}), definition)
+            for machine_type, definition in machine_types.items()
+        ]
+        if default is not None:
+            conditions.append(
+                (~Q(**{f"{type_field.attname}__in": list(machine_types)}), default)
+            )
+        return conditions
+
+    def transitionable(self, trigger: str) -> StateMachineQuerySet:
+        """Entities in a state `trigger` is available from"""
+        conditions = [
+            type_condition & Q(state__in=sorted(definition.trigger_sources[trigger]))
+            for type_condition, definition in self._definition_conditions()
+            if trigger in definition.trigger_sources
+        ]
+        if not conditions:
+            return self.none()
+        return self.filter(reduce(operator.or_, conditions))
+
+    def with_available_triggers(
+        self, name: str = "available_triggers"
+    ) -> StateMachineQuerySet:
+        """Annotate entities with the triggers available from their state"""
+        output_field = ArrayField(models.CharField())
+        return self.annotate(
+            **{
+                name: Case(
+                    *(
+                        When(
+                            type_condition & Q(state=state),
+                            then=Value(list(triggers), output_field=output_field),
+                        )
+                        for type_condition, definition in self._definition_conditions()
+                        for state, triggers in definition.state_triggers.items()
+                        if triggers
+                    ),
+                    default=Value([], output_field=output_field),
+                    output_field=output_field,
+                )
+            }
+        )
+
+
+class TransitionMethod:
+    """Trigger of a transition as a method of entities, e.g. `entity.submit(...)`.
+
+    Installed on state machine models for every transition of their `Transitions`
+    (see `StateMachineModel.install_transition_methods`), the machine is shared so
+    the trigger is bound to the entity on access.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        if self.name not in instance.machine_definition().transitions_set:
+            raise AttributeError(
+                f"'{type(instance).__name__}' object has no attribute '{self.name}', "
+                f"not a transition of its state machine definition"
+            )
+        return partial(instance.trigger, self.name)
 
 
 class StateMachineModel(models.Model):
@@ -197,13 +488,31 @@ class StateMachineModel(models.Model):
     """
 
     post_transition = Signal()
+    # sent once by `bulk_transition` with the kwargs of every transitioned entity
+    post_bulk_transition = Signal()
     _transitions_cls: Transitions
     _machine: DynamicallyNamedMachine
-    _machine_definition: Dict[str, StateMachineDefinition]
     _synchronous_actions_fn: Callable
-    _state_machine_methods: Set = {"trigger", "machine"}
-    _creating: bool = False
     _transition_user = None
+    # shared between entities to resolve permissions once per scope, see `can_transition`
+    _transition_perms_cache: Dict = None
+    # collects transitions in `bulk_transition` instead of saving and signalling
+    _bulk_transition_events: List[TransitionEvent] = None
+    # outbox model (see `outbox.BackgroundActionOutboxModel`), when set background
+    # actions are written in the transaction of transitions and relayed on commit.
+    background_action_outbox: ClassRef = None
+    # field values when the transition started, see `get_dirty_fields`
+    _field_snapshot: Dict = None
+
+    # write transitions with an `UPDATE ... WHERE state=<source>` (or the version
+    # field, incremented by every transition) instead of locking the row, raising
+    # `TransitionConflict` if the entity was modified concurrently.
+    transition_compare_and_swap = False
+    transition_version_field: str = None
+    _compare_and_swap: Dict = None
+
+    # querysets of subclasses should extend `StateMachineQuerySet`
+    objects = StateMachineQuerySet.as_manager()
 
     class Meta:
         abstract = True
@@ -213,35 +522,162 @@ class StateMachineModel(models.Model):
         self._bypass_perms: bool = False
         # init state machine
 
-    def __getattr__(self, name):
-        # all possible machine methods to determine initialization (can't get local methods as not initialized)
-        if name in self._state_machine_methods | self.transitions_cls.transitions():
-            if self._creating:
-                raise AttributeError()
-            if not hasattr(self, "_machine"):
-                self.create_machine()
-            # local state machine methods to ensure attr actually exists
-            if (
-                name
-                in self.machine_definition().transitions_set
-                | self._state_machine_methods
-            ):
-                return getattr(self, name)
-        raise AttributeError(
-            f"'{type(self).__name__}' object has no attribute '{name}', is in machine "
-            f"methods: {name in self._state_machine_methods}"
-        )
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # otherwise installed once apps are ready, see `DjangoExtrasConfig.ready`
+        if "_transitions_cls" in cls.__dict__:
+            cls.install_transition_methods()
+
+    @classmethod
+    def install_transition_methods(cls):
+        """Install a `TransitionMethod` for every transition of `transitions_cls`
+        which does not override an attribute of the class. Models without
+        transitions (see `transitions_cls`) have none."""
+        if cls.transitions_cls is None:
+            return
+        for name in cls.transitions_cls.transitions():
+            if not isinstance(getattr(cls, name, None), (TransitionMethod, type(None))):
+                continue
+            setattr(cls, name, TransitionMethod(name))
+
+    def trigger(self, transition_name: str, *args, **kwargs) -> bool:
+        if self._field_snapshot is not None or self._bulk_transition_events is not None:
+            return self.machine.trigger_event(self, transition_name, *args, **kwargs)
+        # track fields modified by the transition, its synchronous action and
+        # `post_transition` receivers, written once the signal is sent
+        self.snapshot_fields()
+        try:
+            result = self.machine.trigger_event(self, transition_name, *args, **kwargs)
+            if result:
+                self.save_dirty_fields()
+            return result
+        finally:
+            self._field_snapshot = None
 
     def transition(
-        self, transition_name: str, bypass_perms=False, save=False, **kwargs
+        self,
+        transition_name: str,
+        bypass_perms=False,
+        save=False,
+        update_fields: List[str] = None,
+        **kwargs,
     ):
+        """Trigger `transition_name`, fields modified by the transition are written
+        as by `trigger`. With `save` the entity is written even if the transition is
+        not allowed, with fields modified before the transition: every field, or
+        `update_fields` only along the fields modified by the transition."""
         self._bypass_perms = bypass_perms
-        result = self.trigger(transition_name, **kwargs)
-        self._bypass_perms = False
-        if save:
-            self.save()
+        self.snapshot_fields()
+        try:
+            result = self.trigger(transition_name, **kwargs)
+            if save:
+                if update_fields is None:
+                    update_fields = [
+                        field.attname
+                        for field in self._meta.concrete_fields
+                        if not field.primary_key and field.attname in self.__dict__
+                    ]
+                self.save_dirty_fields(update_fields=update_fields)
+            elif result:
+                self.save_dirty_fields()
+        finally:
+            self._bypass_perms = False
+            self._field_snapshot = None
         return result
 
+    def snapshot_fields(self):
+        """Keep the current field values to compute `get_dirty_fields` against"""
+        snapshot = dict()
+        for field in self._meta.concrete_fields:
+            value = self.__dict__.get(field.attname, DEFERRED)
+            if field.primary_key or value is DEFERRED:
+                continue
+            # mutable values (e.g. json) may be modified in place
+            if isinstance(value, (dict, list, set)):
+                value = copy.deepcopy(value)
+            snapshot[field.attname] = value
+        self._field_snapshot = snapshot
+
+    def get_dirty_fields(self) -> Union[List[str], None]:
+        """Fields modified since `snapshot_fields`, None without snapshot"""
+        if self._field_snapshot is None:
+            return None
+        return [
+            field.attname
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (
+                field.attname not in self._field_snapshot
+                or self._field_snapshot[field.attname] != self.__dict__[field.attname]
+            )
+        ]
+
+    def save_dirty_fields(self, update_fields: List[str] = None, **kwargs):
+        """Save fields modified since `snapshot_fields` (and `update_fields`) with a
+        single `UPDATE`, the whole entity is saved if no snapshot was taken or it is
+        not created yet."""
+        dirty_fields = self.get_dirty_fields()
+        if dirty_fields is not None:
+            dirty_fields += [
+                field for field in update_fields or [] if field not in dirty_fields
+            ]
+        if dirty_fields is None or self._state.adding:
+            self.save(**kwargs)
+        elif dirty_fields:
+            dirty_fields += [
+                field.attname
+                for field in self._meta.concrete_fields
+                if getattr(field, "auto_now", False)
+                and field.attname not in dirty_fields
+            ]
+            if self.transition_compare_and_swap and "state" in dirty_fields:
+                self._save_compare_and_swap(dirty_fields, **kwargs)
+            else:
+                self.save(update_fields=dirty_fields, **kwargs)
+        else:
+            return
+        if self._field_snapshot is not None:
+            self.snapshot_fields()
+
+    def _save_compare_and_swap(self, update_fields: List[str], **kwargs):
+        version_field = self.transition_version_field
+        if version_field is not None:
+            version = getattr(self, version_field)
+            self._compare_and_swap = {version_field: version}
+            setattr(self, version_field, version + 1)
+            update_fields = [*update_fields, version_field]
+        else:
+            self._compare_and_swap = {"state": self._field_snapshot.get("state")}
+        try:
+            self.save(update_fields=update_fields, **kwargs)
+        except TransitionConflict:
+            if version_field is not None:
+                setattr(self, version_field, version)
+            raise
+        finally:
+            self._compare_and_swap = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if self._compare_and_swap is None:
+            return super()._do_update(
+                base_qs, using, pk_val, values, update_fields, forced_update
+            )
+        updated = super()._do_update(
+            base_qs.filter(**self._compare_and_swap),
+            using,
+            pk_val,
+            values,
+            update_fields,
+            forced_update,
+        )
+        if not updated:
+            raise TransitionConflict(
+                f"{type(self).__name__} {pk_val} was modified concurrently, "
+                f"expected {self._compare_and_swap}"
+            )
+        return updated
+
     @classmethod
     @property
     def transitions_cls(cls) -> Transitions:
@@ -270,6 +706,52 @@ class StateMachineModel(models.Model):
         """
         Get available transitions for the entity.
         """
+        return self._available_transitions(
+            self.machine_definition().state_triggers.get(self.state, ()),
+            *args,
+            **kwargs,
+        )
+
+    @classmethod
+    def available_transitions_for(cls, entities, user=None) -> Dict[str, Dict]:
+        """
+        Get available transitions of many entities, e.g. a page of a list endpoint.
+        Entities are grouped by definition and state to look up their triggers once
+        per group, permissions of `user` are resolved once per permission scope.
+        Results are cached on each entity's `available_transitions`.
+
+        Parameters
+        ----------
+        entities: queryset or list of entities
+        user: user to check permissions for, otherwise `_transition_user` of entities
+
+        Returns
+        -------
+        Dict[str, Dict]: available transitions keyed by entity id
+        """
+        perms_cache = dict()
+        groups = defaultdict(list)
+        for entity in entities:
+            groups[(entity.machine_definition(), entity.state)].append(entity)
+
+        available_transitions = dict()
+        for (definition, state), group in groups.items():
+            triggers = definition.state_triggers.get(state, ())
+            for entity in group:
+                if user is not None:
+                    entity._transition_user = user
+                entity._transition_perms_cache = perms_cache
+                try:
+                    # populate the cached property
+                    entity.__dict__[
+                        "available_transitions"
+                    ] = entity._available_transitions(triggers)
+                finally:
+                    entity._transition_perms_cache = None
+                available_transitions[str(entity.pk)] = entity.available_transitions
+        return available_transitions
+
+    def _available_transitions(self, triggers: List[str], *args, **kwargs) -> Dict:
         transitions = dict()
         event_data = EventData(
             state=self.state,
@@ -279,19 +761,14 @@ class StateMachineModel(models.Model):
             args=args,
             kwargs=kwargs,
         )
-        for trigger in self.machine.get_triggers(self.state):
+        for trigger in triggers:
+            # transition of the trigger from the entity's state
             event = self.machine.events[trigger]
-
-            event_transitions: List[
-                List[TransitionWithMeta]
-            ] = event.transitions.values()
-            transitions[trigger] = all(
-                any(
-                    condition.check(event_data)
-                    # TransitionWithMeta.conditions
-                    for condition in transition[0].conditions
-                )
-                for transition in event_transitions
+            transition: TransitionWithMeta = event.transitions[self.state][0]
+            transitions[trigger] = any(
+                condition.check(event_data)
+                # TransitionWithMeta.conditions
+                for condition in transition.conditions
             )
         transitions = {
             trigger: dict()
@@ -300,44 +777,62 @@ class StateMachineModel(models.Model):
         }
         return transitions
 
-    def create_machine(
-        self,
+    def create_machine(self, **machine_kwargs):
+        """
+        Attach the entity to the machine shared by its definition, the machine is
+        compiled once per process on first use (see `compile_machine`).
+
+        Arguments:
+            **machine_kwargs: Passed on to `compile_machine` if not yet compiled
+        """
+        definition = self.machine_definition()
+        self._machine = machine_registry.get(
+            definition.path,
+            lambda: self.compile_machine(definition, **machine_kwargs),
+        )
+
+    @classmethod
+    def compile_machine(
+        cls,
+        definition: StateMachineDefinition,
         *,
         send_event=True,
         auto_transitions=False,
         **extra_kwargs,
-    ):
+    ) -> DynamicallyNamedMachine:
         """
-        Create a `transitions.Machine` based on yaml definition.
+        Create a model-less `transitions.Machine` based on the json definition.
+        Callbacks are given by name so they resolve on the transitioned entity.
 
         Arguments:
-            name: Name of the machine definition
-            model: Django model instance
-            initial: initial state
+            definition: State machine definition of the entities
             **extra_kwargs: Passed on the `transitions.Machine` initialisation
         """
-        if self._creating:
-            raise RuntimeError("Machine is being created")
-        # this is to ensure that the machine isn't being created multiple times at
-        # any point.
-        self._creating = True
         common_args = {
-            "prepare_event": self.prepare_event,
+            "prepare_event": "prepare_event",
             "send_event": send_event,
             "auto_transitions": auto_transitions,
-            "initial": self.state,
-            "model": self,
-            "after_state_change": self.entity_transitioned,
+            "initial": None,
+            "model": None,
+            "after_state_change": "entity_transitioned",
         }
-        definition = self.machine_definition().definition
         assert set(extra_kwargs).isdisjoint(
-            set(definition) | set(common_args)
+            set(definition.definition) | set(common_args)
         ), "Arguments override definition"
 
-        self._machine = DynamicallyNamedMachine(
-            **definition, **common_args, **extra_kwargs
+        machine = DynamicallyNamedMachine(
+            **definition.definition, **common_args, **extra_kwargs
         )
-        self._creating = False
+        # `Machine.add_model` registers `on_enter_<state>`/`on_exit_<state>` model
+        # methods as state callbacks, register them once for the class instead.
+        for state in machine.states.values():
+            for callback in machine.state_cls.dynamic_methods:
+                method = f"{callback}_{state.name}"
+                if callable(getattr(cls, method, None)) and method not in getattr(
+                    state, callback
+                ):
+                    state.add_callback(callback[3:], method)
+        return machine
 
     def can_transition(
         self, transition: TransitionWithMeta, *args, user_id=None, **kwargs
@@ -359,56 +854,63 @@ class StateMachineModel(models.Model):
         if not settings.AUTHZ_ACTIVE or self._bypass_perms:
             return True
 
-        result = False
-        # not pretty, but we have less restraint on non-user objects
-        # we only care if the result is set to False for these.
-        if not isinstance(self, MODEL_USER.instance):
-            result = True
         # _transition_user may have been assigned if a user_id (from a request) does not exist.
         # this might need to be reworked at some point. we use it as cache to avoid retrieving the user
-        # every time.
+        # every time, within a permission scope (request) users are only retrieved once.
         if self._transition_user is None and user_id is not None:
-            self._transition_user = MODEL_USER.instance.objects.get(id=user_id)
+            self._transition_user = get_permission_resolver(user_id=user_id).user
         if self._transition_user is None:
             return True
+        if self._transition_perms_cache is None:
+            return self._has_transition_permission(transition)
 
+        key = (self._transition_permission_scope(), tuple(transition.permissions))
+        if key not in self._transition_perms_cache:
+            self._transition_perms_cache[key] = self._has_transition_permission(
+                transition
+            )
+        return self._transition_perms_cache[key]
+
+    def _transition_permission_scope(self) -> tuple:
+        """What `_has_transition_permission` depends on besides the transition"""
+        user_pk = self._transition_user.pk
+        if not isinstance(self, MODEL_USER.instance):
+            return self.__class__, user_pk
+        if user_pk != self.pk:
+            return self.__class__, user_pk, self.type
+        return self.__class__, user_pk, None
+
+    def _has_transition_permission(self, transition: TransitionWithMeta) -> bool:
         # PERMISSION LAYER
-        # groups to check if transition.permissions exist in
-        relevant_groups = None
         # The new system only operates over the User model, we can use the new system
         # over all state machines by removing this conditional.
         if isinstance(self, MODEL_USER.instance):
-            # global_permission is a `special` permission related to the state machine
-            # which if a group contains it, the other permissions in that group
-            # operate over all users inheriting the state machine, rather than just self.
-            global_permission = (
-                f"state_machine_{self.__class__.__name__.lower()}_{self.type}"
-            )
+            # group permissions of the user are resolved once (per request), see
+            # `django_extras.state_machine.permissions.permission_scope`.
+            resolver = get_permission_resolver(user=self._transition_user)
             # aggregate relevant groups depending if we are operating over self or another user
             # if we want to expand this to other state machines, the conditional for whether or not an
             # object relates to a user will have to be more complex than just `pk` comparison.
+            # we only operate over groups for now, user assigned permissions are ignored.
             if self._transition_user.pk != self.pk:
-                relevant_groups = self._transition_user.groups.filter(
-                    Q(permissions__codename=global_permission)
+                # global_permission is a `special` permission related to the state machine
+                # which if a group contains it, the other permissions in that group
+                # operate over all users inheriting the state machine, rather than just self.
+                global_permission = (
+                    f"{GLOBAL_PERMISSION_PREFIX}"
+                    f"{self.__class__.__name__.lower()}_{self.type}"
                 )
-            else:
-                relevant_groups = self._transition_user.groups.filter(
-                    ~Q(permissions__codename__icontains="state_machine_")
-                )
-        else:
-            # OLD STANDARD to be depreciated.
-            if transition.permissions:
-                return any(
-                    self._transition_user.has_perm(f"accounts.{permission}")
-                    for permission in transition.permissions
+                return resolver.global_groups_have_any(
+                    global_permission, transition.permissions
                 )
-            return True
-        if relevant_groups is not None:
-            # we only operate over groups for now, user assigned permissions are ignored.
-            result = relevant_groups.filter(
-                permissions__codename__in=transition.permissions
-            ).exists()
-        return result
+            return resolver.local_groups_have_any(transition.permissions)
+        # OLD STANDARD to be depreciated.
+        if transition.permissions:
+            return any(
+                self._transition_user.has_perm(f"accounts.{permission}")
+                for permission in transition.permissions
+            )
+        return True
 
     @classmethod
     def prepare_event(cls, event_data):
@@ -425,15 +927,9 @@ class StateMachineModel(models.Model):
         event_data.model.last_transition = event_data.event.name.rstrip("_")
 
     def machine_definition(self) -> StateMachineDefinition:
-        cls = self.__class__
-        if not hasattr(cls, "_machine_definition"):
-            cls._machine_definition = dict()
-        path = StateMachineDefinition.get_state_machine_path(self)
-        if path not in cls._machine_definition:
-            cls._machine_definition[path] = StateMachineDefinition(
-                entity=self, path=path
-            )
-        return cls._machine_definition[path]
+        return definition_registry.get(
+            StateMachineDefinition.get_state_machine_path(self)
+        )
 
     @staticmethod
     @default_shared_task()
@@ -441,23 +937,49 @@ class StateMachineModel(models.Model):
         sender = locate(kwargs.get("sender"))
         request_user = MODEL_USER.instance.objects.get(pk=kwargs.get("request_user_id"))
         entity: StateMachineModel = sender.objects.get(pk=kwargs.get("entity_id"))
-        kwargs["entity"] = entity
-        kwargs["request_user"] = request_user
+        entity._perform_background_action(request_user=request_user, **kwargs)
+
+    @staticmethod
+    @default_shared_task()
+    def perform_bulk_background_action(**kwargs):
+        """Background action of `bulk_transition`, `entity_ids` replaces `entity_id`"""
+        sender = locate(kwargs.get("sender"))
+        request_user = MODEL_USER.instance.objects.filter(
+            pk=kwargs.get("request_user_id")
+        ).first()
+        entity_ids = kwargs.pop("entity_ids")
+        for entity in sender.objects.filter(pk__in=entity_ids):
+            entity._perform_background_action(
+                request_user=request_user, entity_id=str(entity.pk), **kwargs
+            )
+
+    def _perform_background_action(self, save=True, **kwargs):
+        if save:
+            self.snapshot_fields()
+        kwargs["entity"] = self
         action = getattr(
-            entity.machine_definition().background_actions_module,
+            self.machine_definition().background_actions_module,
             kwargs.get("transition_name"),
             None,
         )
-        entity._perform_background_action_pre(action=action, **kwargs)
+        self._perform_background_action_pre(action=action, **kwargs)
         if action:
-            action(entity, **kwargs)
-        entity._perform_background_action_post(action=action, **kwargs)
-        entity.save()
+            action(self, **kwargs)
+        self._perform_background_action_post(action=action, **kwargs)
+        if save:
+            self.save_dirty_fields()
+            self._field_snapshot = None
 
     def perform_synchronous_action(self, **kwargs):
-        kwargs["request_user"] = MODEL_USER.instance.objects.get(
-            pk=kwargs.get("request_user_id")
-        )
+        # the transition user is already retrieved when permissions are checked
+        request_user = self._transition_user
+        request_user_id = kwargs.get("request_user_id")
+        if request_user_id is None:
+            # e.g. transitions of a task, without requesting user
+            request_user = None
+        elif request_user is None or str(request_user.pk) != str(request_user_id):
+            request_user = MODEL_USER.instance.objects.get(pk=request_user_id)
+        kwargs["request_user"] = request_user
         action = getattr(
             self.machine_definition().synchronous_actions_module,
             kwargs.get("transition_name"),
@@ -467,7 +989,8 @@ class StateMachineModel(models.Model):
         if action:
             action(self, **kwargs)
         self._perform_synchronous_action_post(action=action, **kwargs)
-        self.save()
+        # modified fields are written once the transition is complete, by
+        # `trigger` (or `bulk_transition`)
 
     def _perform_background_action_pre(self, action: Callable = None, **kwargs):
         ...
@@ -483,21 +1006,8 @@ class StateMachineModel(models.Model):
 
     @classmethod
     def get_entity_transitioned_signal_kwargs(cls, event_data, transition):
-        transition_dict = deepcopy(event_data.transition.__dict__)
-        transition_dict.pop("conditions", None)
-        # TODO: remove all this, unnecessary complexity, replace with dataclass for legibility
-        return {
-            "sender": event_data.model.__class__,
-            "instance": event_data.model,
-            "entity_id": str(event_data.model.id),
-            "source": transition.source,
-            "target": transition.dest,
-            "transition": transition_dict,
-            "transition_name": event_data.event.name,
-            "request_user_id": event_data.kwargs.pop("user_id", None),
-            "data": event_data.kwargs.get("payload") or {},
-            "kwargs": event_data.kwargs or {},
-        }
+        # kept for compatibility, see `TransitionEvent.signal_kwargs`
+        return TransitionEvent.from_event_data(event_data).signal_kwargs()
 
     @classmethod
     def entity_transitioned(cls, event_data: EventData):
@@ -505,9 +1015,238 @@ class StateMachineModel(models.Model):
         Fires a signal which can be hooked into
         after a successful transition.
         """
-        transition = event_data.transition
-        signal_kwargs = cls.get_entity_transitioned_signal_kwargs(
-            event_data, transition
-        )
+        event = TransitionEvent.from_event_data(event_data)
+        signal_kwargs = event.signal_kwargs()
         event_data.model.perform_synchronous_action(**signal_kwargs)
+        if event_data.model._bulk_transition_events is not None:
+            event_data.model._bulk_transition_events.append(event)
+            return
         cls.post_transition.send(**signal_kwargs)
+        cls._queue_background_actions([event])
+
+    @classmethod
+    def bulk_transition(
+        cls,
+        queryset,
+        transition_name: str,
+        *,
+        user_id=None,
+        user=None,
+        payload: Dict = None,
+        bypass_perms=False,
+        update_fields: List[str] = None,
+        batch_size: int = None,
+    ) -> List[TransitionResult]:
+        """Transition every entity of a queryset with the same trigger.
+
+        The user is retrieved once and permissions are resolved once per permission
+        scope. Fields modified by transitions (see `get_dirty_fields`) are written
+        with a single `bulk_update`, `post_bulk_transition` is sent once instead of `post_transition` for each
+        entity and background actions are written to the outbox (if any), otherwise
+        queued as one task per definition once the transaction is committed.
+
+        Parameters
+        ----------
+        queryset: entities (or list of entities) to transition
+        transition_name: trigger to call on every entity
+        user_id: id of the user requesting the transition
+        user: user requesting the transition, e.g. `request.user` (anonymous users
+        included), instead of retrieving the user of `user_id`
+        payload: transition data, passed on as `data` to actions and signals
+        bypass_perms: skip permission checks
+        update_fields: fields to be written along the fields modified by transitions,
+        e.g. modified before the transition
+        batch_size: batch size of the `bulk_update`
+
+        With `transition_compare_and_swap` the rows of entities are locked first,
+        entities modified since they were loaded are not transitioned (CONFLICT).
+        The `transition_version_field` of transitioned entities is incremented.
+
+        Returns
+        -------
+        List[TransitionResult]: result of each entity, in queryset order
+        """
+        if user is None and user_id is not None:
+            user = MODEL_USER.instance.objects.get(pk=user_id)
+        perms_cache = dict()
+        events: List[TransitionEvent] = []
+        results: List[TransitionResult] = []
+        fields = {"state", *(update_fields or [])}
+
+        with transaction.atomic():
+            entities = list(queryset)
+            modified = set()
+            if cls.transition_compare_and_swap:
+                modified = cls._lock_unmodified(entities)
+            for entity in entities:
+                result = TransitionResult(entity_id=str(entity.pk), success=False)
+                result.source = entity.state
+                results.append(result)
+                if entity.pk in modified:
+                    result.error = TransitionResult.CONFLICT
+                    result.detail = (
+                        f"{cls.__name__} {entity.pk} was modified concurrently"
+                    )
+                    continue
+                definition = entity.machine_definition()
+                if definition.get_destination(transition_name, entity.state) is None:
+                    result.error = TransitionResult.CONFLICT
+                    result.detail = (
+                        f"Can't trigger event {transition_name} from state "
+                        f"{entity.state}!"
+                    )
+                    continue
+
+                entity._transition_user = user
+                entity._transition_perms_cache = perms_cache
+                entity._bulk_transition_events = events
+                entity._bypass_perms = bypass_perms
+                entity.snapshot_fields()
+                try:
+                    result.success = entity.trigger(
+                        transition_name, user_id=user_id, payload=payload
+                    )
+                    if result.success:
+                        fields.update(entity.get_dirty_fields())
+                except MachineError as e:
+                    result.error = TransitionResult.CONFLICT
+                    result.detail = e.args[0]
+                    continue
+                finally:
+                    entity._transition_perms_cache = None
+                    entity._bulk_transition_events = None
+                    entity._bypass_perms = False
+                    entity._field_snapshot = None
+                if result.success:
+                    result.target = entity.state
+                else:
+                    result.error = TransitionResult.DENIED
+                    result.detail = f"Transition {transition_name} not allowed"
+
+            if not events:
+                return results
+            instances = [event.instance for event in events]
+            version_field = cls.transition_version_field
+            if version_field is not None:
+                # concurrent compare and swap transitions of the entities conflict
+                fields.add(version_field)
+                for instance in instances:
+                    setattr(
+                        instance, version_field, getattr(instance, version_field) + 1
+                    )
+            # `bulk_update` does not update `auto_now` fields, as `save_dirty_fields`
+            for field in cls._meta.concrete_fields:
+                if getattr(field, "auto_now", False):
+                    fields.add(field.attname)
+                    for instance in instances:
+                        field.pre_save(instance, add=False)
+            cls.objects.bulk_update(instances, fields, batch_size=batch_size)
+            cls.post_bulk_transition.send(
+                sender=cls,
+                transition_name=transition_name,
+                request_user_id=user_id,
+                events=events,
+            )
+            cls._queue_bulk_background_actions(
+                events, transition_name, user_id, payload
+            )
+        return results
+
+    @classmethod
+    def _lock_unmodified(cls, entities: List[StateMachineModel]) -> Set:
+        """Lock the rows of `entities` for the transaction, returns the pks of those
+        modified since they were loaded: their version (see
+        `transition_version_field`), otherwise state, changed."""
+        field = cls.transition_version_field or "state"
+        current = dict(
+            cls.objects.select_for_update()
+            .filter(pk__in=[entity.pk for entity in entities])
+            .order_by("pk")
+            .values_list("pk", field)
+        )
+        return {
+            entity.pk
+            for entity in entities
+            if current.get(entity.pk) != getattr(entity, field)
+        }
+
+    @classmethod
+    def bulk_transition_in_batches(
+        cls,
+        queryset,
+        transition_name: str,
+        *,
+        batch_size: int = BULK_TRANSITION_BATCH_SIZE,
+        **kwargs,
+    ) -> List[TransitionResult]:
+        """`bulk_transition` of a queryset in batches of `batch_size` entities (in
+        primary key order), every batch is transitioned in its own transaction.
+        Keyword arguments are passed on to `bulk_transition`."""
+        pks = list(queryset.order_by("pk").values_list("pk", flat=True))
+        results: List[TransitionResult] = []
+        for i in range(0, len(pks), batch_size):
+            results += cls.bulk_transition(
+                queryset.filter(pk__in=pks[i : i + batch_size]).order_by("pk"),
+                transition_name,
+                **kwargs,
+            )
+        return results
+
+    @staticmethod
+    @default_shared_task(ignore_result=False)
+    def perform_bulk_transition(**kwargs) -> List[Dict]:
+        """`bulk_transition_in_batches` of `entity_ids`, returns the result of each
+        entity (see `TransitionResult`)"""
+        sender = locate(kwargs.pop("sender"))
+        entity_ids = kwargs.pop("entity_ids")
+        if kwargs.pop("anonymous", False):
+            # permissions are checked as for the anonymous user of the request
+            kwargs["user"] = AnonymousUser()
+        results = sender.bulk_transition_in_batches(
+            sender.objects.filter(pk__in=entity_ids), **kwargs
+        )
+        return [dataclasses.asdict(result) for result in results]
+
+    @classmethod
+    def _queue_background_actions(cls, events: List[TransitionEvent]):
+        """Write background actions of transitions to the outbox, if any."""
+        if cls.background_action_outbox is None:
+            return
+        events = [
+            event
+            for event in events
+            if getattr(
+                event.instance.machine_definition().background_actions_module,
+                event.transition_name,
+                None,
+            )
+        ]
+        if events:
+            outbox.add(cls.background_action_outbox.instance, events)
+
+    @classmethod
+    def _queue_bulk_background_actions(
+        cls,
+        events: List[TransitionEvent],
+        transition_name: str,
+        user_id,
+        payload: Dict = None,
+    ):
+        if cls.background_action_outbox is not None:
+            cls._queue_background_actions(events)
+            return
+        entity_ids = defaultdict(list)
+        for event in events:
+            entity_ids[event.instance.machine_definition()].append(event.entity_id)
+        for definition, ids in entity_ids.items():
+            if getattr(definition.background_actions_module, transition_name, None):
+                transaction.on_commit(
+                    partial(
+                        cls.perform_bulk_background_action.delay,
+                        sender=f"{cls.__module__}.{cls.__name__}",
+                        entity_ids=ids,
+                        transition_name=transition_name,
+                        request_user_id=None if user_id is None else str(user_id),
+                        data=payload or {},
+                    )
+                )
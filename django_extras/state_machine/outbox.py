@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from functools import partial
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Type
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from django_extras.celery import default_shared_task
+from django_extras.config.models_foreign import MODEL_USER
+
+if TYPE_CHECKING:
+    from django_extras.state_machine.models import TransitionEvent
+
+logger = logging.getLogger(__name__)
+
+# maximum number of entities processed by a single worker task
+RELAY_BATCH_SIZE = 100
+# actions dispatched but not performed after this delay are dispatched again when
+# relaying with `relay_background_actions`, e.g. if a worker was lost.
+RELAY_REDISPATCH_AFTER = timedelta(minutes=15)
+# set while a coalesced relay of an outbox is scheduled, see `schedule_coalesced_relay`
+CACHE_KEY_RELAY_SCHEDULED = "background_action_relay_scheduled:"
+
+
+class BackgroundActionOutboxModel(models.Model):
+    """
+    An abstract base class model of a transactional outbox for state machine
+    background actions.
+
+    Actions are written in the transaction of the transition and relayed to workers
+    in batches once it is committed (see `relay`), workers never read uncommitted
+    entities. Actions of the same entity are coalesced, they are performed by a
+    single worker in order and the entity is saved once.
+
+    With a `coalesce_window` actions are relayed once the window elapsed instead of
+    on commit, actions of every transaction committed meanwhile are relayed
+    together, e.g. bursts of transitions of an entity are performed by one task.
+    """
+
+    coalesce_window: Optional[timedelta] = None
+
+    # label of the entity model, e.g. accounts.User
+    sender = models.CharField(max_length=255)
+    entity_id = models.CharField(max_length=64)
+    transition_name = models.CharField(max_length=100)
+    source = models.CharField(max_length=100)
+    target = models.CharField(max_length=100)
+    request_user_id = models.CharField(max_length=64, null=True, blank=True)
+    data = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(auto_now_add=True)
+    dispatched = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_event(cls, event: TransitionEvent) -> BackgroundActionOutboxModel:
+        """Outbox entry of a transition"""
+        request_user_id = event.request_user_id
+        return cls(
+            sender=event.sender._meta.label,
+            entity_id=event.entity_id,
+            transition_name=event.transition_name,
+            source=event.source,
+            target=event.target,
+            request_user_id=None if request_user_id is None else str(request_user_id),
+            data=event.data,
+        )
+
+    @property
+    def action_kwargs(self) -> Dict:
+        sender = apps.get_model(self.sender)
+        return {
+            "sender": f"{sender.__module__}.{sender.__name__}",
+            "entity_id": self.entity_id,
+            "transition_name": self.transition_name,
+            "source": self.source,
+            "target": self.target,
+            "request_user_id": self.request_user_id,
+            "data": self.data,
+        }
+
+
+def add(
+    outbox: Type[BackgroundActionOutboxModel],
+    events: List[TransitionEvent],
+    using: str = None,
+):
+    """Write background actions of transitions and relay them on commit."""
+    outbox.objects.using(using).bulk_create(
+        [outbox.from_event(event) for event in events]
+    )
+    schedule_relay(outbox, using=using)
+
+
+def schedule_relay(outbox: Type[BackgroundActionOutboxModel], using: str = None):
+    """Relay the outbox once the current transaction is committed, scheduled once
+    per transaction regardless of the number of transitions. Failing to relay does
+    not fail the committed transaction, actions are relayed again later."""
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.in_atomic_block and any(
+        getattr(func, "outbox", None) is outbox
+        for _, func, *_ in connection.run_on_commit
+    ):
+        return
+    if outbox.coalesce_window is None:
+        callback = partial(relay, outbox, using=using)
+    else:
+        callback = partial(schedule_coalesced_relay, outbox)
+    callback.outbox = outbox
+    # logged by django if the callback raises, partials have no qualified name
+    callback.__qualname__ = callback.func.__qualname__
+    transaction.on_commit(callback, using=using, robust=True)
+
+
+def schedule_coalesced_relay(outbox: Type[BackgroundActionOutboxModel]):
+    """Relay the outbox once its `coalesce_window` elapsed, a single relay is
+    scheduled per window. Actions committed while a relay is scheduled are relayed
+    by it, as it never runs before the window (and its cache key) expired."""
+    label = outbox._meta.label
+    window = outbox.coalesce_window.total_seconds()
+    cache_key = f"{CACHE_KEY_RELAY_SCHEDULED}{label}"
+    if cache.add(cache_key, True, window):
+        try:
+            relay_background_actions.apply_async(
+                kwargs={"outbox": label}, countdown=window
+            )
+        except Exception:
+            # scheduled by the next transaction instead
+            cache.delete(cache_key)
+            raise
+
+
+def relay(
+    outbox: Type[BackgroundActionOutboxModel],
+    using: str = None,
+    batch_size: int = RELAY_BATCH_SIZE,
+    redispatch_after: Optional[timedelta] = None,
+) -> int:
+    """Dispatch pending background actions to workers in batches of entities.
+    Actions are marked dispatched once their batch is sent, batches failing to be
+    sent are dispatched by the next relay.
+
+    Parameters
+    ----------
+    outbox: outbox model
+    using: database alias
+    batch_size: maximum number of entities per worker task
+    redispatch_after: also dispatch actions dispatched before this delay
+
+    Returns
+    -------
+    int: number of dispatched actions
+    """
+    pending_filter = Q(dispatched__isnull=True)
+    if redispatch_after is not None:
+        pending_filter |= Q(dispatched__lt=timezone.now() - redispatch_after)
+    with transaction.atomic(using=using):
+        pending = list(
+            outbox.objects.using(using)
+            .select_for_update(skip_locked=True)
+            .filter(pending_filter)
+            .order_by("pk")
+            .values_list("pk", "sender", "entity_id")
+        )
+        if not pending:
+            return 0
+        # coalesce actions of the same entity, in transition order
+        entities: Dict[Tuple[str, str], List[int]] = dict()
+        for pk, sender, entity_id in pending:
+            entities.setdefault((sender, entity_id), []).append(pk)
+        batches = list(entities.values())
+        dispatched: List[int] = []
+        # entries stay locked until dispatched is committed, workers deleting them
+        # wait for it
+        for i in range(0, len(batches), batch_size):
+            ids = [pk for pks in batches[i : i + batch_size] for pk in pks]
+            try:
+                perform_outbox_background_actions.delay(
+                    outbox=outbox._meta.label, ids=ids
+                )
+            except Exception as e:
+                logger.exception(msg=f"[RELAY FAILED] {outbox._meta.label}: {e}")
+                continue
+            dispatched += ids
+        outbox.objects.using(using).filter(pk__in=dispatched).update(
+            dispatched=timezone.now()
+        )
+    return len(dispatched)
+
+
+@default_shared_task()
+def relay_background_actions(outbox: str):
+    """Periodic relay of actions which were not dispatched or performed."""
+    relay(apps.get_model(outbox), redispatch_after=RELAY_REDISPATCH_AFTER)
+
+
+@default_shared_task()
+def perform_outbox_background_actions(outbox: str, ids: List[int]):
+    """Perform background actions of a batch of outbox entries.
+
+    Users and entities are retrieved with one query (per entity model), every entity
+    performs its actions in order and its modified fields are saved once, removing its outbox entries in
+    the same transaction. Entries of an entity whose action failed are kept, they
+    are dispatched again by `relay_background_actions`.
+    """
+    outbox_model = apps.get_model(outbox)
+    actions: Dict[Tuple[str, str], List[BackgroundActionOutboxModel]] = dict()
+    for action in outbox_model.objects.filter(pk__in=ids).order_by("pk"):
+        actions.setdefault((action.sender, action.entity_id), []).append(action)
+
+    user_ids = {
+        action.request_user_id
+        for entity_actions in actions.values()
+        for action in entity_actions
+        if action.request_user_id is not None
+    }
+    users = {
+        str(pk): user
+        for pk, user in MODEL_USER.instance.objects.in_bulk(user_ids).items()
+    }
+    entity_ids: Dict[str, List[str]] = dict()
+    for sender, entity_id in actions:
+        entity_ids.setdefault(sender, []).append(entity_id)
+    entities = {
+        (sender, str(pk)): entity
+        for sender, sender_ids in entity_ids.items()
+        for pk, entity in apps.get_model(sender).objects.in_bulk(sender_ids).items()
+    }
+
+    for key, entity_actions in actions.items():
+        entity = entities.get(key)
+        try:
+            with transaction.atomic():
+                if entity is not None:
+                    entity.snapshot_fields()
+                    for action in entity_actions:
+                        entity._perform_background_action(
+                            save=False,
+                            request_user=users.get(action.request_user_id),
+                            **action.action_kwargs,
+                        )
+                    entity.save_dirty_fields()
+                outbox_model.objects.filter(
+                    pk__in=[action.pk for action in entity_actions]
+                ).delete()
+        except Exception as e:
+            logger.exception(msg=f"[BACKGROUND ACTION FAILED] {key}: {e}")
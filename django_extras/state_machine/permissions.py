@@ -0,0 +1,147 @@
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+from django.core.cache import cache
+
+from django_extras.config.models_foreign import MODEL_GROUP, MODEL_USER
+
+# prefix of the global state machine permissions, e.g. state_machine_user_default
+GLOBAL_PERMISSION_PREFIX = "state_machine_"
+
+# versions of permissions of all users (group permissions) and of each user (user
+# groups and permissions), see `get_permission_version`
+CACHE_KEY_PERMISSION_VERSION = "transition_permission_version:"
+CACHE_KEY_USER_PERMISSION_VERSION = "transition_permission_version:user:"
+CACHE_KEY_TRANSITIONS_API = "transitions_api:"
+
+_resolvers: ContextVar[Optional[Dict[str, "TransitionPermissionResolver"]]] = (
+    ContextVar("transition_permission_resolvers", default=None)
+)
+
+
+class TransitionPermissionResolver:
+    """Group permissions of a user relevant to state machine transitions.
+
+    Permission codenames of every group of the user are loaded with a single query
+    on first use, every later check is answered from memory.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._group_codenames: List[FrozenSet[str]] = None
+
+    def load(self):
+        group_codenames: Dict[int, Set[str]] = dict()
+        rows = MODEL_GROUP.instance.permissions.through.objects.filter(
+            group__in=self.user.groups.all()
+        ).values_list("group_id", "permission__codename")
+        for group_id, codename in rows:
+            group_codenames.setdefault(group_id, set()).add(codename)
+        self._group_codenames = [
+            frozenset(codenames) for codenames in group_codenames.values()
+        ]
+
+    @property
+    def group_codenames(self) -> List[FrozenSet[str]]:
+        """Permission codenames of each group of the user"""
+        if self._group_codenames is None:
+            self.load()
+        return self._group_codenames
+
+    def global_groups_have_any(
+        self, global_permission: str, codenames: Iterable[str]
+    ) -> bool:
+        """A group containing `global_permission` contains any of `codenames`"""
+        return any(
+            global_permission in group and not group.isdisjoint(codenames)
+            for group in self.group_codenames
+        )
+
+    def local_groups_have_any(self, codenames: Iterable[str]) -> bool:
+        """A group without state machine permissions contains any of `codenames`"""
+        return any(
+            not any(GLOBAL_PERMISSION_PREFIX in c.lower() for c in group)
+            and not group.isdisjoint(codenames)
+            for group in self.group_codenames
+        )
+
+
+@contextmanager
+def permission_scope():
+    """Share permission resolvers of users within the scope, e.g. a request."""
+    token = _resolvers.set(dict())
+    try:
+        yield
+    finally:
+        _resolvers.reset(token)
+
+
+def get_permission_resolver(user=None, user_id=None) -> TransitionPermissionResolver:
+    """Get the resolver of a user (or user id), shared within a `permission_scope`.
+    Out of a scope the resolver is cached on the user instance.
+    """
+    resolvers = _resolvers.get()
+    key = str(user_id if user is None else user.pk)
+    if resolvers is not None and key in resolvers:
+        return resolvers[key]
+    if user is None:
+        user = MODEL_USER.instance.objects.get(id=user_id)
+
+    resolver = vars(user).get("_transition_permission_resolver")
+    if resolver is None:
+        resolver = TransitionPermissionResolver(user)
+        user._transition_permission_resolver = resolver
+    if resolvers is not None:
+        resolvers[key] = resolver
+    return resolver
+
+
+class PermissionScopeMiddleware:
+    # django_extras.state_machine.permissions.PermissionScopeMiddleware
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with permission_scope():
+            return self.get_response(request)
+
+
+def get_permission_version(user) -> str:
+    """Version of the permissions of `user`, changed when its groups, permissions or
+    the permissions of any group change (see `django_extras.signals`). Values
+    cached with the version in their key are invalidated by a new version."""
+    keys = [
+        CACHE_KEY_PERMISSION_VERSION,
+        f"{CACHE_KEY_USER_PERMISSION_VERSION}{user.pk}",
+    ]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # versions are random, an evicted version can't match stale values
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return ":".join(versions[key] for key in keys)
+
+
+def invalidate_permission_version(user_ids: Iterable = None):
+    """Change the permission version of `user_ids`, or of every user if None"""
+    if user_ids is None:
+        cache.set(CACHE_KEY_PERMISSION_VERSION, uuid.uuid4().hex, None)
+        return
+    cache.set_many(
+        {
+            f"{CACHE_KEY_USER_PERMISSION_VERSION}{user_id}": uuid.uuid4().hex
+            for user_id in user_ids
+        },
+        None,
+    )
+
+
+def get_user_permission_codenames(user) -> Set[str]:
+    """Codenames of the user's (and its groups') permissions, all permissions for
+    superusers. Users without django's `PermissionsMixin` have none."""
+    if not getattr(user, "is_active", True) or not hasattr(user, "get_all_permissions"):
+        return set()
+    return {perm.split(".", 1)[-1] for perm in user.get_all_permissions()}
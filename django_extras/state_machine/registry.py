@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Set, Tuple
+
+from django.apps import apps
+from django.conf import settings
+
+from transitions import MachineError
+
+from django_extras.state_machine.utils import DynamicallyNamedMachine
+
+if TYPE_CHECKING:
+    from django_extras.state_machine.models import StateMachineDefinition
+
+
+class MachineRegistry:
+    """Per-process registry of compiled state machines keyed by definition path.
+
+    Machines are compiled without a bound model, every entity using the same
+    definition is processed by the same machine (see
+    `DynamicallyNamedMachine.trigger_event`).
+    """
+
+    def __init__(self):
+        self._machines: Dict[str, DynamicallyNamedMachine] = dict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._machines
+
+    def __len__(self) -> int:
+        return len(self._machines)
+
+    def get(
+        self, path: str, factory: Callable[[], DynamicallyNamedMachine]
+    ) -> DynamicallyNamedMachine:
+        """Return the machine compiled for `path`, compiling it with `factory` once."""
+        machine = self._machines.get(path)
+        if machine is None:
+            with self._lock:
+                machine = self._machines.get(path)
+                if machine is None:
+                    machine = factory()
+                    self._machines[path] = machine
+        return machine
+
+    def discard(self, path: str = None):
+        """Drop the machine compiled for `path`, or every machine if no path given."""
+        with self._lock:
+            if path is None:
+                self._machines.clear()
+            else:
+                self._machines.pop(path, None)
+
+
+machine_registry = MachineRegistry()
+
+
+class DefinitionRegistry:
+    """Per-process registry of state machine definitions keyed by definition path.
+
+    Definitions found under `{ROOT_DIR}/<app_label>/state_machine/<name>_<type>` are
+    loaded eagerly on app startup (see `DjangoExtrasConfig.ready`), resolving an
+    entity type to its definition path only checks the filesystem once per type.
+    When `settings.DEBUG` is set, definitions are reloaded if their
+    `definition.json` was modified, discarding the machine compiled from them.
+    """
+
+    definition_file = "definition.json"
+
+    def __init__(self):
+        self._definitions: Dict[str, StateMachineDefinition] = dict()
+        # mtime of each definition file when loaded
+        self._versions: Dict[str, int] = dict()
+        # (base path, machine type) -> definition path, including `_default` fallbacks
+        self._resolved_paths: Dict[Tuple[str, str], str] = dict()
+        # base paths whose definitions were all loaded, see `get_by_type`
+        self._scanned_base_paths: Set[str] = set()
+        self._lock = threading.RLock()
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._definitions
+
+    def __len__(self) -> int:
+        return len(self._definitions)
+
+    @property
+    def autoreload(self) -> bool:
+        return settings.DEBUG
+
+    def load(self):
+        """Scan every installed app's state_machine directory and load definitions."""
+        with self._lock:
+            self._definitions.clear()
+            self._versions.clear()
+            self._resolved_paths.clear()
+            self._scanned_base_paths.clear()
+            for app_config in apps.get_app_configs():
+                state_machine_dir = (
+                    f"{settings.ROOT_DIR}/{app_config.label}/state_machine"
+                )
+                if not os.path.isdir(state_machine_dir):
+                    continue
+                with os.scandir(state_machine_dir) as entries:
+                    for entry in entries:
+                        if entry.is_dir() and os.path.isfile(
+                            f"{entry.path}/{self.definition_file}"
+                        ):
+                            self._register(f"{state_machine_dir}/{entry.name}")
+
+    def version(self, path: str) -> int:
+        return self._versions[path]
+
+    def get(self, path: str) -> StateMachineDefinition:
+        """Return the definition at `path`, loading it if it was not found on startup."""
+        definition = self._definitions.get(path)
+        if definition is None:
+            with self._lock:
+                definition = self._definitions.get(path) or self._register(path)
+        elif self.autoreload and self._read_version(path) != self._versions[path]:
+            with self._lock:
+                definition = self._register(path)
+                machine_registry.discard(path)
+        return definition
+
+    def resolve_path(self, base_path: str, machine_type) -> str:
+        """Resolve `{base_path}{machine_type}` falling back to `{base_path}default`.
+
+        Parameters
+        ----------
+        base_path: {ROOT_DIR}/{app_label}/state_machine/{state_machine_name}_
+        machine_type: type of the entity
+
+        Returns
+        -------
+        str: path of the definition directory
+        """
+        key = (base_path, str(machine_type))
+        path = self._resolved_paths.get(key)
+        if path is None:
+            for path in (f"{base_path}{machine_type}", f"{base_path}default"):
+                if path in self._definitions or os.path.isdir(path):
+                    break
+            else:
+                raise MachineError(f"Path does not exist: {path}")
+            self._resolved_paths[key] = path
+        return path
+
+    def get_by_type(self, base_path: str) -> Dict[str, StateMachineDefinition]:
+        """Definitions at `{base_path}{machine_type}` keyed by machine type, the
+        directory of `base_path` is only scanned once."""
+        if base_path not in self._scanned_base_paths:
+            with self._lock:
+                state_machine_dir, prefix = os.path.split(base_path)
+                if os.path.isdir(state_machine_dir):
+                    with os.scandir(state_machine_dir) as entries:
+                        for entry in entries:
+                            path = f"{state_machine_dir}/{entry.name}"
+                            if (
+                                entry.name.startswith(prefix)
+                                and path not in self._definitions
+                                and os.path.isfile(f"{path}/{self.definition_file}")
+                            ):
+                                self._register(path)
+                self._scanned_base_paths.add(base_path)
+        return {
+            path[len(base_path) :]: self.get(path)
+            for path in list(self._definitions)
+            if path.startswith(base_path) and "/" not in path[len(base_path) :]
+        }
+
+    def _read_version(self, path: str) -> int:
+        return os.stat(f"{path}/{self.definition_file}").st_mtime_ns
+
+    def _register(self, path: str) -> StateMachineDefinition:
+        from django_extras.state_machine.models import StateMachineDefinition
+
+        self._versions[path] = self._read_version(path)
+        self._definitions[path] = StateMachineDefinition(entity=None, path=path)
+        return self._definitions[path]
+
+
+definition_registry = DefinitionRegistry()
@@ -0,0 +1,38 @@
+from django.db.models import QuerySet
+
+from rest_framework import serializers
+
+
+class AvailableTransitionsField(serializers.Field):
+    """
+    Read only representation of `StateMachineModel.available_transitions`.
+
+    When serializing many entities, transitions of every entity being serialized
+    are computed in a single `available_transitions_for` call, unless already
+    prefetched (see `StateMachineViewMixin.prefetch_available_transitions`).
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    @property
+    def request_user(self):
+        request = self.context.get("request")
+        return getattr(request, "user", None)
+
+    def to_representation(self, instance):
+        if "available_transitions" not in instance.__dict__:
+            entities = [instance]
+            list_serializer = getattr(self.parent, "parent", None)
+            # the entities of a list serializer are iterated in place, thus their
+            # cached transitions are available when the field is serialized.
+            if isinstance(list_serializer, serializers.ListSerializer) and isinstance(
+                list_serializer.instance, (list, tuple, QuerySet)
+            ):
+                entities = list_serializer.instance
+            instance.__class__.available_transitions_for(
+                entities, user=self.request_user
+            )
+        return instance.available_transitions
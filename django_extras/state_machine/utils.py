@@ -62,3 +62,9 @@ class DynamicallyNamedMachine(transitions.Machine):
     @name.setter
     def name(self, val):
         pass
+
+    def trigger_event(self, model, trigger_name: str, *args, **kwargs) -> bool:
+        """Trigger `trigger_name` on `model` without binding the model to the machine,
+        allowing one compiled machine to be shared by every entity of a definition.
+        """
+        return self._get_trigger(model, trigger_name, *args, **kwargs)
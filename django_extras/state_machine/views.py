@@ -1,22 +1,174 @@
+import hashlib
+import uuid
+from functools import partial, wraps
+from typing import Dict, Optional, Sequence
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.fields.mixins import FieldCacheMixin
 
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiExample, OpenApiParameter, extend_schema
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import (
+    NotAuthenticated,
+    PermissionDenied,
+    ValidationError,
+)
 from rest_framework.response import Response
 from transitions import MachineError
 
-from django_extras.state_machine.models import StateMachineModel
+from django_extras.state_machine.models import (
+    BULK_TRANSITION_BATCH_SIZE,
+    StateMachineModel,
+    TransitionResult,
+)
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+CACHE_KEY_IDEMPOTENT_RESPONSE = "transition_idempotent_response:"
+# cached while the first request with an idempotency key is processed, for at most
+# IDEMPOTENCY_LOCK_TIMEOUT seconds (e.g. if the process was killed)
+IDEMPOTENCY_IN_PROGRESS = "in_progress"
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# status of each entity transitioned by the bulk transition endpoint
+BULK_TRANSITION_STATUS = {
+    None: status.HTTP_200_OK,
+    TransitionResult.CONFLICT: status.HTTP_409_CONFLICT,
+    TransitionResult.DENIED: status.HTTP_403_FORBIDDEN,
+}
+
+
+def bulk_transition_item(result: TransitionResult) -> Dict:
+    return {
+        "id": result.entity_id,
+        "status": BULK_TRANSITION_STATUS[result.error],
+        "source": result.source,
+        "target": result.target,
+        "detail": result.detail,
+    }
+
+
+def idempotent(func):
+    """Replay the response of the first request with the same `Idempotency-Key`
+    header (per user and path) without performing the action again, e.g. retries of
+    a transition. The request is still authenticated, but neither permissions nor
+    the action run again. Responses are cached for `transition_idempotency_ttl`
+    seconds, requests raising an exception are not cached. Requests of anonymous
+    users, which can't be told apart, are always performed."""
+
+    @wraps(func)
+    def wrapper(self, request, *args, **kwargs):
+        cache_key = self.get_idempotency_cache_key(request)
+        if cache_key is None:
+            return func(self, request, *args, **kwargs)
+        if not cache.add(cache_key, IDEMPOTENCY_IN_PROGRESS, IDEMPOTENCY_LOCK_TIMEOUT):
+            cached = cache.get(cache_key)
+            if cached == IDEMPOTENCY_IN_PROGRESS:
+                return Response(
+                    {
+                        "conflict": f"A request with this {IDEMPOTENCY_KEY_HEADER} "
+                        f"is in progress"
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
+            if cached is not None:
+                status_code, data = cached
+                response = Response(data, status=status_code)
+                response["Idempotent-Replayed"] = "true"
+                return response
+        try:
+            response = func(self, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        cache.set(
+            cache_key,
+            (response.status_code, response.data),
+            self.transition_idempotency_ttl,
+        )
+        return response
+
+    return wrapper
 
 
 class StateMachineViewMixin:
+    # compute available transitions of a page at once, see `available_transitions_for`
+    prefetch_available_transitions = False
+    # fields and relations modified besides the transitioned instance, e.g. by
+    # synchronous actions, fetched again for the response of a transition (see
+    # `refresh_transitioned_object`)
+    transition_refresh_fields: Sequence[str] = ()
+    # seconds responses of transitions with an `Idempotency-Key` are replayed for
+    transition_idempotency_ttl = 60 * 60 * 24
+
     def get_object(self):
         obj = super().get_object()
         obj._transition_user = self.request.user
         return obj
 
+    def get_idempotency_cache_key(self, request) -> Optional[str]:
+        key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return None
+        digest = hashlib.sha256(
+            f"{request.user.pk}:{request.method}:{request.path}:{key}".encode()
+        ).hexdigest()
+        return f"{CACHE_KEY_IDEMPOTENT_RESPONSE}{digest}"
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None and self.prefetch_available_transitions:
+            queryset.model.available_transitions_for(page, user=self.request.user)
+        return page
+
+    def refresh_transitioned_object(self, obj: StateMachineModel):
+        """Refresh what a transition may have changed without fetching the object
+        again, fields written by the transition are already up to date.
+
+        Concrete fields of `transition_refresh_fields` are fetched with one query,
+        relations prefetched by the queryset of the view are prefetched again and
+        cached relations are cleared.
+        """
+        obj.__dict__.pop("available_transitions", None)
+        if not self.transition_refresh_fields:
+            return obj
+
+        fields, relations = [], set()
+        for name in self.transition_refresh_fields:
+            try:
+                field = obj._meta.get_field(name)
+            except FieldDoesNotExist:
+                # `to_attr` of a prefetch
+                relations.add(name)
+                continue
+            if field.concrete and not field.many_to_many:
+                fields.append(field.attname)
+                continue
+            relations.add(name)
+            if isinstance(field, FieldCacheMixin) and field.is_cached(obj):
+                field.delete_cached_value(obj)
+        if fields:
+            obj.refresh_from_db(fields=fields)
+
+        prefetched = getattr(obj, "_prefetched_objects_cache", {})
+        for name in relations:
+            prefetched.pop(name, None)
+            obj.__dict__.pop(name, None)
+        lookups = []
+        for lookup in self.get_queryset()._prefetch_related_lookups:
+            prefetch_to = lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+            if prefetch_to.split(LOOKUP_SEP)[0] in relations:
+                lookups.append(lookup)
+        if lookups:
+            prefetch_related_objects([obj], *lookups)
+        return obj
+
     @classmethod
     def generate_transition_method(
         cls,
@@ -25,7 +177,14 @@ class StateMachineViewMixin:
         transition_permission_classes=None,
         transition_detail=True,
         bypass_acl_check=False,
+        transition_full_reload=False,
     ):
+        """
+        Generate the `transition` action of a view.
+
+        The transitioned object is serialized without fetching it again (see
+        `refresh_transitioned_object`), unless `transition_full_reload` is set.
+        """
         if transition_permission_classes is None:
             transition_permission_classes = []
         # Retrieve necessary parameters from class
@@ -42,6 +201,12 @@ class StateMachineViewMixin:
                         as_sorted_list=True
                     ),
                 ),
+                OpenApiParameter(
+                    IDEMPOTENCY_KEY_HEADER,
+                    OpenApiTypes.STR,
+                    OpenApiParameter.HEADER,
+                    description="Retries of a user with the same key replay the first response",
+                ),
             ],
             examples=[
                 OpenApiExample(
@@ -65,6 +230,7 @@ class StateMachineViewMixin:
             url_path=f"{transitions_url_path}/(?P<name>{queryset.model.transitions_cls.transitions_api(as_str='|')})",
             permission_classes=transition_permission_classes,
         )
+        @idempotent
         def transition(self, request, name: str, *args, **kwargs):
             """
             Provides a method for transitioning entities
@@ -72,6 +238,15 @@ class StateMachineViewMixin:
             """
             name = queryset.model.transitions_cls.transitions_api()[name]
             obj: StateMachineModel = self.get_object()
+            if obj.machine_definition().get_destination(name, obj.state) is None:
+                return Response(
+                    {
+                        "transition": name,
+                        "conflict": f"Can't trigger event {name} from state "
+                        f"{obj.state}!",
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
 
             try:
                 with transaction.atomic():
@@ -79,9 +254,10 @@ class StateMachineViewMixin:
                         name,
                         user_id=request.user.id,
                     )
+                    # modified fields are written once by `trigger`, after the
+                    # `post_transition` signal
                     if not trigger_success:
                         raise PermissionDenied(detail=f"Transition {name} not allowed")
-                    obj.save()
 
             except MachineError as e:
                 return Response(
@@ -92,11 +268,14 @@ class StateMachineViewMixin:
                     status=status.HTTP_409_CONFLICT,
                 )
 
-            # Populate fresh nested data after a successful transition
-            get_object_params = (
-                {"bypass_acl_check": bypass_acl_check} if bypass_acl_check else {}
-            )
-            instance = self.get_object(**get_object_params)
+            if transition_full_reload:
+                # Populate fresh nested data after a successful transition
+                get_object_params = (
+                    {"bypass_acl_check": bypass_acl_check} if bypass_acl_check else {}
+                )
+                instance = self.get_object(**get_object_params)
+            else:
+                instance = self.refresh_transitioned_object(obj)
             serializer_kwargs = {"instance": instance, "return_nested_data": True}
 
             response_serializer = self.get_serializer(**serializer_kwargs)
@@ -104,3 +283,162 @@ class StateMachineViewMixin:
             return Response(data=response_serializer.data, status=status.HTTP_200_OK)
 
         return transition
+
+    @classmethod
+    def generate_bulk_transition_method(
+        cls,
+        queryset,
+        transitions_url_path: str = "bulk_transition",
+        transition_permission_classes=None,
+        batch_size: int = BULK_TRANSITION_BATCH_SIZE,
+        background_threshold: int = None,
+    ):
+        """
+        Generate a list-level action transitioning many entities with one trigger.
+
+        Entities are given by `ids` in the payload, otherwise every entity of the
+        filtered queryset of the view. They are transitioned in batches of
+        `batch_size` (see `StateMachineModel.bulk_transition_in_batches`) and the
+        status of each is returned: 200, 403 or 409 as transitioning it alone, 404
+        for ids not found. Object permissions of the view are checked for every
+        entity, as `get_object` does for a single transition. Above `background_threshold` entities the transitions are
+        performed by a worker, the `job_id` of its task is returned with a 202.
+        """
+        if transition_permission_classes is None:
+            transition_permission_classes = []
+        model = queryset.model
+
+        @extend_schema(
+            operation_id=f"{model.__name__.lower()}s_bulk_transition",
+            description=f"Transition many {model.__name__.lower()}s: `{model.transitions_cls.transitions_api(as_str=', ')}`",
+            parameters=[
+                OpenApiParameter(
+                    "name",
+                    OpenApiTypes.STR,
+                    OpenApiParameter.PATH,
+                    enum=model.transitions_cls.transitions_api(as_sorted_list=True),
+                ),
+                OpenApiParameter(
+                    IDEMPOTENCY_KEY_HEADER,
+                    OpenApiTypes.STR,
+                    OpenApiParameter.HEADER,
+                    description="Retries of a user with the same key replay the first response",
+                ),
+            ],
+            examples=[
+                OpenApiExample(
+                    name="Bulk Transition Payload",
+                    value={"ids": []},
+                    description=f"Ids of the {model.__name__.lower()}s to "
+                    f"transition, every filtered {model.__name__.lower()} if omitted",
+                )
+            ],
+            responses={
+                status.HTTP_200_OK: None,
+                status.HTTP_202_ACCEPTED: None,
+                status.HTTP_400_BAD_REQUEST: None,
+            },
+        )
+        @action(
+            methods=["post"],
+            detail=False,
+            url_path=f"{transitions_url_path}/(?P<name>{model.transitions_cls.transitions_api(as_str='|')})",
+            permission_classes=transition_permission_classes,
+        )
+        @idempotent
+        def bulk_transition(self, request, name: str, *args, **kwargs):
+            """
+            Provides a method for transitioning many entities
+            within a view returning the result of each.
+            """
+            name = model.transitions_cls.transitions_api()[name]
+            entities = self.filter_queryset(self.get_queryset())
+            ids = request.data.get("ids")
+            if ids is not None and not isinstance(ids, list):
+                raise ValidationError({"ids": "Expected a list of ids"})
+            try:
+                if ids is not None:
+                    entities = entities.filter(pk__in=ids)
+                entities = list(entities.order_by("pk"))
+            except (ValueError, DjangoValidationError):
+                raise ValidationError({"ids": "Invalid ids"})
+
+            entity_ids, denied = [], []
+            for obj in entities:
+                try:
+                    self.check_object_permissions(request, obj)
+                except (NotAuthenticated, PermissionDenied) as e:
+                    denied.append(
+                        TransitionResult(
+                            entity_id=str(obj.pk),
+                            success=False,
+                            source=obj.state,
+                            error=TransitionResult.DENIED,
+                            detail=str(e.detail),
+                        )
+                    )
+                    continue
+                entity_ids.append(str(obj.pk))
+
+            user_id = None if request.user.id is None else str(request.user.id)
+            found = {str(obj.pk) for obj in entities}
+            not_found = [
+                {"id": str(pk), "status": status.HTTP_404_NOT_FOUND}
+                for pk in ids or []
+                if str(pk) not in found
+            ]
+
+            if (
+                background_threshold is not None
+                and len(entity_ids) > background_threshold
+            ):
+                job_id = str(uuid.uuid4())
+                transaction.on_commit(
+                    partial(
+                        model.perform_bulk_transition.apply_async,
+                        kwargs={
+                            "sender": f"{model.__module__}.{model.__name__}",
+                            "entity_ids": entity_ids,
+                            "transition_name": name,
+                            "batch_size": batch_size,
+                            "user_id": user_id,
+                            "anonymous": request.user.is_anonymous,
+                        },
+                        task_id=job_id,
+                    )
+                )
+                return Response(
+                    {
+                        "transition": name,
+                        "job_id": job_id,
+                        "count": len(entity_ids),
+                        "results": [bulk_transition_item(r) for r in denied]
+                        + not_found,
+                    },
+                    status=status.HTTP_202_ACCEPTED,
+                )
+
+            results = model.bulk_transition_in_batches(
+                model.objects.filter(pk__in=entity_ids),
+                name,
+                batch_size=batch_size,
+                user_id=user_id,
+                user=request.user,
+            )
+            results = {r.entity_id: r for r in [*results, *denied]}
+            items = []
+            for obj in entities:
+                result = results.get(str(obj.pk))
+                if result is None:
+                    # deleted since the entities were loaded
+                    not_found.append(
+                        {"id": str(obj.pk), "status": status.HTTP_404_NOT_FOUND}
+                    )
+                    continue
+                items.append(bulk_transition_item(result))
+            return Response(
+                {"transition": name, "results": items + not_found},
+                status=status.HTTP_200_OK,
+            )
+
+        return bulk_transition
@@ -1,10 +1,13 @@
+import json
 import logging
 import shutil
+import threading
 import time
 import uuid
+import warnings
 from collections import defaultdict
 from pathlib import Path
-from typing import Callable, List
+from typing import Callable, Dict, Iterable, List
 from unittest.mock import MagicMock, Mock
 
 from django.apps import apps
@@ -27,6 +30,8 @@ logger = logging.getLogger(__name__)
 # Constants for the source and destination paths
 TEST_MIGRATIONS_PATH = Path(__file__).parent / "test_migrations"
 MIGRATIONS_PATH = Path(__file__).parent.parent / "migrations"
+# timings slower than the baseline by this factor are reported as regressions
+BENCHMARK_TIME_TOLERANCE = 2.0
 
 
 class ExtendedCaptureQueriesContext(CaptureQueriesContext):
@@ -83,6 +88,15 @@ class ExtendedCaptureQueriesContext(CaptureQueriesContext):
             assert False, msgs
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--update-benchmark-baseline",
+        action="store_true",
+        default=False,
+        help="Write results of `benchmark_runner` to the baseline of each module",
+    )
+
+
 def pytest_configure(config):
     shutil.copytree(TEST_MIGRATIONS_PATH, MIGRATIONS_PATH, dirs_exist_ok=True)
 
@@ -202,6 +216,109 @@ def db_threshold_factory(db, settings):
     return _runner
 
 
+class BenchmarkRunner:
+    """Time a function and count its queries, comparing the results to the baseline
+    stored as json next to the test module (`test_<name>.json`).
+
+    Query counts are deterministic, a benchmark running more queries per round than
+    its baseline fails. Timings depend on the machine, slower timings only warn.
+    Baselines are written with `pytest --update-benchmark-baseline -n 0`.
+    """
+
+    def __init__(self, baseline_path: Path, update: bool = False):
+        self.baseline_path = baseline_path
+        self.update = update
+
+    def load_baseline(self) -> Dict[str, Dict]:
+        if not self.baseline_path.exists():
+            return dict()
+        return json.loads(self.baseline_path.read_text())
+
+    def __call__(self, name: str, fn: Callable, inputs: Iterable) -> Dict:
+        """Call `fn` once per input, returns the time and queries per round"""
+        inputs = list(inputs)
+        with ExtendedCaptureQueriesContext(connections["default"]) as context:
+            for value in inputs:
+                fn(value)
+        result = {
+            "rounds": len(inputs),
+            "time_per_round": context.final_queries_time / len(inputs),
+            "queries_per_round": len(context.captured_queries) / len(inputs),
+        }
+        baseline = self.load_baseline()
+        expected = baseline.get(name)
+        print(
+            f"BENCHMARK {name} [{len(inputs)}]: "
+            f"{result['time_per_round']:.6f}s, "
+            f"{result['queries_per_round']:.2f} queries per round"
+            + (
+                ""
+                if expected is None
+                else f" (baseline {expected['time_per_round']:.6f}s, "
+                f"{expected['queries_per_round']:.2f} queries)"
+            )
+        )
+        if self.update:
+            baseline[name] = result
+            self.baseline_path.write_text(
+                json.dumps(baseline, indent=2, sort_keys=True) + "\n"
+            )
+            return result
+        if expected is None:
+            return result
+        assert result["queries_per_round"] <= expected["queries_per_round"], (
+            f"{name}: {result['queries_per_round']} queries per round, "
+            f"baseline {expected['queries_per_round']}"
+        )
+        if result["time_per_round"] > (
+            expected["time_per_round"] * BENCHMARK_TIME_TOLERANCE
+        ):
+            warnings.warn(
+                f"{name}: {result['time_per_round']:.6f}s per round, "
+                f"baseline {expected['time_per_round']:.6f}s"
+            )
+        return result
+
+
+@pytest.fixture
+def benchmark_runner(request, db) -> BenchmarkRunner:
+    return BenchmarkRunner(
+        Path(request.module.__file__).with_suffix(".json"),
+        update=request.config.getoption("--update-benchmark-baseline"),
+    )
+
+
+@pytest.fixture
+def run_concurrently(transactional_db):
+    """Run callables in threads, each with its own database connection. Callables
+    receive a `sync` function blocking until every thread called it, e.g. to
+    transition an entity once every thread loaded it.
+    Returns the result or the raised exception of each callable."""
+
+    def _run(*fns: Callable, timeout: float = 10) -> List:
+        barrier = threading.Barrier(len(fns))
+        results = [None] * len(fns)
+
+        def target(i, fn):
+            try:
+                results[i] = fn(lambda: barrier.wait(timeout))
+            except Exception as e:
+                results[i] = e
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=target, args=(i, fn)) for i, fn in enumerate(fns)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout)
+        return results
+
+    return _run
+
+
 @pytest.fixture
 def db_localhost_t2_q5(db_threshold_factory):
     return db_threshold_factory("localhost", 0.2, 5)
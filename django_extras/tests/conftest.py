@@ -1,6 +1,12 @@
+import json
+
+from django.db import models
+
 import pytest
 
 from ..serializers_utils import ParentSerializer
+from ..state_machine.models import StateMachineModel, Transitions
+from ..state_machine.outbox import BackgroundActionOutboxModel
 
 
 @pytest.fixture(scope="session")
@@ -34,3 +40,92 @@ def test_model_serializer_class(test_model_class, test_model_parent_serializer_c
 def seeded_graph_test_models(factory_seed_graph_data_for_model, test_model_class):
     root = factory_seed_graph_data_for_model(test_model_class)
     return root
+
+
+@pytest.fixture(scope="session")
+def state_machine_definition():
+    return {
+        "name": "teststatemachinemodel",
+        "states": ["draft", "submitted", "approved", "rejected"],
+        "transitions": [
+            {"trigger": "submit", "source": "draft", "dest": "submitted"},
+            {
+                "trigger": "approve",
+                "source": "submitted",
+                "dest": "approved",
+                "meta": {"permissions": ["approve"]},
+            },
+            {"trigger": "reject", "source": "submitted", "dest": "rejected"},
+            {
+                "trigger": "redraft",
+                "source": ["submitted", "rejected"],
+                "dest": "draft",
+            },
+        ],
+    }
+
+
+@pytest.fixture(scope="session")
+def state_machine_root_dir(tmp_path_factory, state_machine_definition):
+    root_dir = tmp_path_factory.mktemp("root_dir")
+    path = (
+        root_dir / "django_extras" / "state_machine" / "teststatemachinemodel_default"
+    )
+    path.mkdir(parents=True)
+    (path / "definition.json").write_text(json.dumps(state_machine_definition))
+    return root_dir
+
+
+@pytest.fixture
+def state_machine_settings(settings, state_machine_root_dir):
+    settings.ROOT_DIR = str(state_machine_root_dir)
+    settings.AUTHZ_ACTIVE = False
+    return settings
+
+
+@pytest.fixture(scope="session")
+def test_state_machine_model_class():
+    class TestStateMachineModelTransitions(Transitions):
+        SUBMIT = "submit"
+        APPROVE = "approve"
+        REJECT = "reject"
+        REDRAFT = "redraft"
+
+        @classmethod
+        def get_model(cls):
+            return TestStateMachineModel
+
+    class TestStateMachineModel(StateMachineModel):
+        _transitions_cls = TestStateMachineModelTransitions
+
+        state = models.CharField(max_length=50, default="draft")
+        last_transition = models.CharField(max_length=50, default="", blank=True)
+        version = models.PositiveIntegerField(default=0)
+
+        class Meta:
+            app_label = "django_extras"
+            verbose_name = "teststatemachinemodel"
+
+    yield TestStateMachineModel
+
+
+@pytest.fixture(scope="session")
+def test_typed_state_machine_model_class():
+    class TestTypedStateMachineModel(StateMachineModel):
+        state = models.CharField(max_length=50, default="draft")
+        type = models.PositiveIntegerField(default=1)
+
+        class Meta:
+            app_label = "django_extras"
+            verbose_name = "testtypedmodel"
+
+    yield TestTypedStateMachineModel
+
+
+@pytest.fixture(scope="session")
+def test_background_action_outbox_class():
+    class TestBackgroundActionOutbox(BackgroundActionOutboxModel):
+        class Meta:
+            app_label = "django_extras"
+
+    yield TestBackgroundActionOutbox
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_extras", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TestStateMachineModel",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("state", models.CharField(default="draft", max_length=50)),
+                (
+                    "last_transition",
+                    models.CharField(blank=True, default="", max_length=50),
+                ),
+            ],
+            options={
+                "verbose_name": "teststatemachinemodel",
+            },
+        ),
+    ]
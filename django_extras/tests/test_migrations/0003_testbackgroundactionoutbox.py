@@ -0,0 +1,47 @@
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_extras", "0002_teststatemachinemodel"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TestBackgroundActionOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sender", models.CharField(max_length=255)),
+                ("entity_id", models.CharField(max_length=64)),
+                ("transition_name", models.CharField(max_length=100)),
+                ("source", models.CharField(max_length=100)),
+                ("target", models.CharField(max_length=100)),
+                (
+                    "request_user_id",
+                    models.CharField(blank=True, max_length=64, null=True),
+                ),
+                (
+                    "data",
+                    models.JSONField(
+                        blank=True,
+                        default=dict,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("dispatched", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_extras", "0003_testbackgroundactionoutbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="teststatemachinemodel",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,1716 @@
+import dataclasses
+import json
+import os
+import pickle
+import sys
+import time
+from copy import deepcopy
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import MagicMock, Mock, call
+
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from model_bakery import baker
+from rest_framework import permissions, serializers, viewsets
+from rest_framework.test import APIRequestFactory, force_authenticate
+from transitions import EventData
+
+from ..class_ref import ClassRef
+from ..config.models_foreign import MODEL_USER
+from ..state_machine import outbox
+from ..state_machine.models import (
+    StateMachineDefinition,
+    TransitionConflict,
+    TransitionEvent,
+    TransitionMethod,
+    TransitionResult,
+)
+from ..state_machine.permissions import (
+    TransitionPermissionResolver,
+    get_permission_resolver,
+    get_permission_version,
+    invalidate_permission_version,
+    permission_scope,
+)
+from ..state_machine.registry import DefinitionRegistry, machine_registry
+from ..state_machine.serializers import AvailableTransitionsField
+from ..state_machine.utils import DynamicallyNamedMachine
+from ..state_machine.views import StateMachineViewMixin
+
+
+@pytest.fixture
+def state_machine_model(state_machine_settings, test_state_machine_model_class):
+    machine_registry.discard()
+    return test_state_machine_model_class
+
+
+@pytest.fixture
+def state_machine_user(db):
+    return baker.make(MODEL_USER.instance)
+
+
+class TestSharedMachine:
+    def test_entities_share_machine(self, state_machine_model):
+        # ARRANGE
+        entities = [state_machine_model(state="draft") for _ in range(3)]
+        # ACT
+        machines = {id(entity.machine) for entity in entities}
+        # ASSERT
+        assert len(machines) == 1
+        assert len(machine_registry) == 1
+        assert entities[0].machine.models == []
+
+    def test_available_transitions_per_entity_state(self, state_machine_model):
+        # ARRANGE
+        draft = state_machine_model(state="draft")
+        submitted = state_machine_model(state="submitted")
+        # ACT / ASSERT
+        assert set(draft.available_transitions) == {"submit"}
+        assert set(submitted.available_transitions) == {
+            "approve",
+            "reject",
+            "redraft",
+        }
+
+    def test_transition_method_resolves_trigger(self, state_machine_model):
+        # ARRANGE
+        entity = state_machine_model(state="draft")
+        # ACT
+        submit = entity.submit
+        # ASSERT
+        assert submit.func == entity.trigger
+        assert submit.args == ("submit",)
+
+    def test_transition_methods_installed(self, monkeypatch, state_machine_model):
+        # ARRANGE
+        entity = state_machine_model(state="draft")
+        definition = entity.machine_definition()
+        monkeypatch.setattr(definition, "_transitions_set", {"submit"})
+        # ACT / ASSERT
+        assert isinstance(state_machine_model.__dict__["approve"], TransitionMethod)
+        assert entity.submit.args == ("submit",)
+        with pytest.raises(AttributeError):
+            entity.approve
+        assert not hasattr(entity, "_prefetched_objects_cache")
+
+    def test_transition_methods_without_transitions(
+        self, test_typed_state_machine_model_class
+    ):
+        # ARRANGE
+        model = test_typed_state_machine_model_class
+        # ACT
+        model.install_transition_methods()
+        # ASSERT
+        assert model.transitions_cls is None
+        assert not hasattr(model(), "submit")
+
+    def test_benchmark_attribute_miss(self, state_machine_model):
+        # ARRANGE
+        n_lookups = 5000
+        transitions_cls = state_machine_model.transitions_cls
+
+        class InterceptedEntity:
+            # previous behaviour, attribute misses intercepted by `__getattr__`
+            _state_machine_methods = {"trigger", "machine"}
+
+            def __getattr__(self, name):
+                if name in self._state_machine_methods | transitions_cls.transitions():
+                    raise NotImplementedError
+                raise AttributeError(name)
+
+        intercepted_entity = InterceptedEntity()
+        entity = state_machine_model(state="draft")
+        # ACT
+        start = time.perf_counter()
+        for _ in range(n_lookups):
+            hasattr(intercepted_entity, "_prefetched_objects_cache")
+        intercepted_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(n_lookups):
+            hasattr(entity, "_prefetched_objects_cache")
+        descriptor_time = time.perf_counter() - start
+        # ASSERT
+        print(
+            f"ATTRIBUTE MISS [{n_lookups}]: __getattr__ {intercepted_time:.6f}s, "
+            f"descriptors {descriptor_time:.6f}s"
+        )
+        assert descriptor_time < intercepted_time
+
+    def test_benchmark_machine_per_entity(self, state_machine_model):
+        # ARRANGE
+        n_entities = 200
+        definition = state_machine_model(state="draft").machine_definition()
+        entities = [state_machine_model(state="draft") for _ in range(n_entities)]
+        # ACT
+        start = time.perf_counter()
+        for entity in entities:
+            # previous behaviour, a machine compiled for every entity
+            DynamicallyNamedMachine(
+                **definition.definition,
+                initial=entity.state,
+                send_event=True,
+                auto_transitions=False,
+            )
+        compiled_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for entity in entities:
+            entity.create_machine()
+        shared_time = time.perf_counter() - start
+        # ASSERT
+        print(
+            f"MACHINE PER ENTITY [{n_entities}]: compiled {compiled_time:.6f}s, "
+            f"shared {shared_time:.6f}s"
+        )
+        assert shared_time < compiled_time
+
+
+class TestDirtyFields:
+    def test_transition_writes_modified_fields_once(
+        self, mocker, state_machine_model, state_machine_user
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="draft")
+        save = mocker.spy(entity, "save")
+        # ACT
+        with CaptureQueriesContext(connection) as context:
+            with transaction.atomic():
+                assert entity.trigger("submit", user_id=str(state_machine_user.pk))
+        # ASSERT
+        updates = [q for q in context.captured_queries if q["sql"].startswith("UPDATE")]
+        assert len(updates) == 1
+        save.assert_called_once_with(update_fields=["state", "last_transition"])
+        entity.refresh_from_db()
+        assert (entity.state, entity.last_transition) == ("submitted", "submit")
+
+    @pytest.mark.parametrize("update_fields", [None, ["version"]])
+    def test_transition_save_writes_fields_modified_before(
+        self, state_machine_model, state_machine_user, update_fields
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="draft")
+        entity.version = 5
+        # ACT
+        entity.transition(
+            "submit",
+            save=True,
+            update_fields=update_fields,
+            user_id=str(state_machine_user.pk),
+        )
+        # ASSERT
+        assert state_machine_model.objects.values_list("state", "version").get() == (
+            "submitted",
+            5,
+        )
+
+    def test_trigger_writes_fields_modified_by_receivers(
+        self, state_machine_model, state_machine_user
+    ):
+        # ARRANGE
+        def receiver(sender, instance, **kwargs):
+            instance.version = 42
+
+        entity = baker.make(state_machine_model, state="draft")
+        state_machine_model.post_transition.connect(receiver)
+        # ACT
+        with CaptureQueriesContext(connection) as context:
+            try:
+                entity.trigger("submit", user_id=str(state_machine_user.pk))
+            finally:
+                state_machine_model.post_transition.disconnect(receiver)
+        # ASSERT
+        updates = [q for q in context.captured_queries if q["sql"].startswith("UPDATE")]
+        assert len(updates) == 1
+        assert state_machine_model.objects.values_list("state", "version").get() == (
+            "submitted",
+            42,
+        )
+
+    def test_save_dirty_fields_without_changes(
+        self, db, state_machine_model, django_assert_num_queries
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="draft", last_transition="x")
+        entity.snapshot_fields()
+        entity.last_transition = "x"
+        # ACT / ASSERT
+        assert entity.get_dirty_fields() == []
+        with django_assert_num_queries(0):
+            entity.save_dirty_fields()
+
+    def test_save_dirty_fields_without_snapshot_saves_entity(
+        self, db, mocker, state_machine_model
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="draft")
+        save = mocker.spy(entity, "save")
+        # ACT
+        entity.save_dirty_fields()
+        # ASSERT
+        save.assert_called_once_with()
+
+
+class TestCompareAndSwap:
+    @pytest.fixture
+    def user_id(self, state_machine_user):
+        return str(state_machine_user.pk)
+
+    @pytest.mark.parametrize("version_field", [None, "version"])
+    def test_conflict_on_concurrent_modification(
+        self, monkeypatch, state_machine_model, user_id, version_field
+    ):
+        # ARRANGE
+        monkeypatch.setattr(state_machine_model, "transition_compare_and_swap", True)
+        monkeypatch.setattr(
+            state_machine_model, "transition_version_field", version_field
+        )
+        entity = baker.make(state_machine_model, state="submitted")
+        # modified since the entity was loaded
+        state_machine_model.objects.filter(pk=entity.pk).update(
+            state="rejected", version=1
+        )
+        # ACT / ASSERT
+        with pytest.raises(TransitionConflict):
+            with transaction.atomic():
+                entity.trigger("reject", user_id=user_id)
+        assert state_machine_model.objects.get(pk=entity.pk).last_transition == ""
+
+    def test_version_incremented(self, monkeypatch, state_machine_model, user_id):
+        # ARRANGE
+        monkeypatch.setattr(state_machine_model, "transition_compare_and_swap", True)
+        monkeypatch.setattr(state_machine_model, "transition_version_field", "version")
+        entity = baker.make(state_machine_model, state="draft")
+        # ACT
+        entity.trigger("submit", user_id=user_id)
+        # ASSERT
+        entity.refresh_from_db()
+        assert (entity.state, entity.version) == ("submitted", 1)
+
+    @pytest.mark.parametrize("version_field", [None, "version"])
+    def test_bulk_transition_conflict_on_concurrent_modification(
+        self, monkeypatch, state_machine_model, user_id, version_field
+    ):
+        # ARRANGE
+        monkeypatch.setattr(state_machine_model, "transition_compare_and_swap", True)
+        monkeypatch.setattr(
+            state_machine_model, "transition_version_field", version_field
+        )
+        entities = baker.make(state_machine_model, state="submitted", _quantity=3)
+        # modified since the entities were loaded
+        state_machine_model.objects.filter(pk=entities[1].pk).update(
+            state="rejected", version=1
+        )
+        # ACT
+        results = state_machine_model.bulk_transition(
+            entities, "approve", user_id=user_id, bypass_perms=True
+        )
+        # ASSERT
+        assert [(result.success, result.error) for result in results] == [
+            (True, None),
+            (False, TransitionResult.CONFLICT),
+            (True, None),
+        ]
+        assert list(
+            state_machine_model.objects.order_by("pk").values_list("state", "version")
+        ) == [
+            ("approved", 1 if version_field else 0),
+            ("rejected", 1),
+            ("approved", 1 if version_field else 0),
+        ]
+
+    def test_transition_conflicts_after_bulk_transition(
+        self, monkeypatch, state_machine_model, user_id
+    ):
+        # ARRANGE
+        monkeypatch.setattr(state_machine_model, "transition_compare_and_swap", True)
+        monkeypatch.setattr(state_machine_model, "transition_version_field", "version")
+        entity = baker.make(state_machine_model, state="submitted")
+        state_machine_model.bulk_transition(
+            state_machine_model.objects.filter(pk=entity.pk), "reject", user_id=user_id
+        )
+        # ACT / ASSERT
+        with pytest.raises(TransitionConflict):
+            with transaction.atomic():
+                entity.trigger("approve", user_id=user_id)
+        assert state_machine_model.objects.get(pk=entity.pk).state == "rejected"
+
+    @pytest.mark.parametrize("compare_and_swap, n_conflicts", [(False, 0), (True, 1)])
+    def test_concurrent_transitions(
+        self,
+        monkeypatch,
+        run_concurrently,
+        state_machine_model,
+        user_id,
+        compare_and_swap,
+        n_conflicts,
+    ):
+        # ARRANGE
+        monkeypatch.setattr(
+            state_machine_model, "transition_compare_and_swap", compare_and_swap
+        )
+        entity_id = baker.make(state_machine_model, state="submitted").pk
+
+        def transition(name):
+            def _transition(sync):
+                entity = state_machine_model.objects.get(pk=entity_id)
+                sync()
+                with transaction.atomic():
+                    return entity.trigger(name, user_id=user_id)
+
+            return _transition
+
+        # ACT
+        results = run_concurrently(transition("approve"), transition("reject"))
+        # ASSERT
+        conflicts = [r for r in results if isinstance(r, TransitionConflict)]
+        assert len(conflicts) == n_conflicts
+        assert results.count(True) == 2 - n_conflicts
+        assert state_machine_model.objects.get(pk=entity_id).state in {
+            "approved",
+            "rejected",
+        }
+
+
+class TestTransitionEvent:
+    @pytest.fixture
+    def event_data(self, state_machine_model):
+        entity = state_machine_model(pk=1, state="draft")
+        machine = entity.machine
+        event_data = EventData(
+            machine.get_state("draft"),
+            machine.events["submit"],
+            machine,
+            entity,
+            args=(),
+            kwargs={"user_id": "2", "payload": {"key": "value"}},
+        )
+        event_data.transition = machine.events["submit"].transitions["draft"][0]
+        return event_data
+
+    def test_post_transition_receivers_compatible(
+        self, state_machine_model, state_machine_user
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="draft")
+        receiver = Mock()
+        state_machine_model.post_transition.connect(receiver, weak=False)
+        # ACT
+        try:
+            entity.trigger("submit", user_id=str(state_machine_user.pk))
+        finally:
+            state_machine_model.post_transition.disconnect(receiver)
+        # ASSERT
+        kwargs = receiver.call_args.kwargs
+        assert kwargs["sender"] is state_machine_model
+        assert kwargs["instance"] is entity
+        assert (kwargs["source"], kwargs["target"]) == ("draft", "submitted")
+        assert kwargs["transition_name"] == "submit"
+        assert kwargs["transition"]["dest"] == "submitted"
+        assert "conditions" not in kwargs["transition"]
+        assert kwargs["event"]["entity_id"] == kwargs["entity_id"]
+
+    def test_transition_dict_is_a_copy(self, event_data):
+        # ARRANGE
+        event = TransitionEvent.from_event_data(event_data)
+        # ACT
+        transition_dict = event.transition_dict
+        transition_dict["_meta"]["permissions"] = ["approve"]
+        transition_dict["after"].append("callback")
+        # ASSERT
+        assert event.transition.permissions == []
+        assert "callback" not in event.transition.after
+        assert (
+            pickle.loads(pickle.dumps(event.transition_dict)) == event.transition_dict
+        )
+
+    def test_transition_event_is_frozen_and_slotted(self, event_data):
+        # ACT
+        event = TransitionEvent.from_event_data(event_data)
+        # ASSERT
+        assert event.request_user_id == "2"
+        assert event.data == {"key": "value"}
+        assert event.transition is event_data.transition
+        assert not hasattr(event, "__dict__")
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            event.target = "approved"
+        with pytest.raises(KeyError):
+            event["missing"]
+
+    def test_benchmark_signal_kwargs(self, event_data):
+        # ARRANGE
+        n_transitions = 2000
+        # ACT
+        start = time.perf_counter()
+        for _ in range(n_transitions):
+            # previous behaviour, signal kwargs with a deepcopied transition
+            transition_dict = deepcopy(event_data.transition.__dict__)
+            transition_dict.pop("conditions", None)
+            {
+                "sender": event_data.model.__class__,
+                "instance": event_data.model,
+                "entity_id": str(event_data.model.id),
+                "source": event_data.transition.source,
+                "target": event_data.transition.dest,
+                "transition": transition_dict,
+                "transition_name": event_data.event.name,
+                "request_user_id": event_data.kwargs.get("user_id", None),
+                "data": event_data.kwargs.get("payload") or {},
+                "kwargs": event_data.kwargs or {},
+            }
+        deepcopy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(n_transitions):
+            TransitionEvent.from_event_data(event_data).signal_kwargs()
+            event_data.kwargs["user_id"] = "2"
+        event_time = time.perf_counter() - start
+        # ASSERT
+        print(
+            f"SIGNAL KWARGS [{n_transitions}]: deepcopy {deepcopy_time:.6f}s, "
+            f"event {event_time:.6f}s"
+        )
+        assert event_time < deepcopy_time
+
+
+class TestDefinitionRegistry:
+    @pytest.fixture
+    def definition_path(self, state_machine_root_dir):
+        return (
+            f"{state_machine_root_dir}/django_extras/state_machine/"
+            f"teststatemachinemodel_default"
+        )
+
+    def test_load_scans_app_state_machine_dirs(
+        self, state_machine_settings, definition_path
+    ):
+        # ARRANGE
+        registry = DefinitionRegistry()
+        # ACT
+        registry.load()
+        # ASSERT
+        assert definition_path in registry
+        assert registry.get(definition_path).transitions_set == {
+            "submit",
+            "approve",
+            "reject",
+            "redraft",
+        }
+
+    def test_resolve_path_falls_back_to_default_once(
+        self, mocker, state_machine_settings, definition_path
+    ):
+        # ARRANGE
+        registry = DefinitionRegistry()
+        registry.load()
+        base_path = definition_path[: -len("default")]
+        isdir = mocker.spy(os.path, "isdir")
+        # ACT
+        paths = {registry.resolve_path(base_path, "other") for _ in range(3)}
+        # ASSERT
+        assert paths == {definition_path}
+        assert isdir.call_count == 1
+
+    def test_get_reloads_modified_definition_in_debug(
+        self, settings, tmp_path, state_machine_definition
+    ):
+        # ARRANGE
+        settings.DEBUG = True
+        path = tmp_path / "teststatemachinemodel_default"
+        path.mkdir()
+        (path / "definition.json").write_text(json.dumps(state_machine_definition))
+        registry = DefinitionRegistry()
+        definition = registry.get(str(path))
+        version = registry.version(str(path))
+        updated_definition = dict(
+            state_machine_definition,
+            transitions=state_machine_definition["transitions"][:1],
+        )
+        (path / "definition.json").write_text(json.dumps(updated_definition))
+        os.utime(path / "definition.json", ns=(version + 1, version + 1))
+        # ACT
+        reloaded_definition = registry.get(str(path))
+        # ASSERT
+        assert reloaded_definition is not definition
+        assert reloaded_definition.transitions_set == {"submit"}
+
+
+class TestDefinitionLookupTables:
+    @pytest.fixture
+    def definition(self, state_machine_model):
+        return state_machine_model(state="draft").machine_definition()
+
+    def test_state_triggers(self, definition):
+        # ASSERT
+        assert definition.state_triggers == {
+            "draft": ("submit",),
+            "submitted": ("approve", "reject", "redraft"),
+            "approved": (),
+            "rejected": ("redraft",),
+        }
+
+    def test_destinations_and_meta(self, definition):
+        # ASSERT
+        assert definition.get_destination("redraft", "rejected") == "draft"
+        assert definition.get_destination("approve", "draft") is None
+        assert definition.trigger_meta["approve"]["permissions"] == ["approve"]
+        with pytest.raises(TypeError):
+            definition.destinations[("approve", "draft")] = "approved"
+
+    def test_wildcard_and_reflexive_transitions(self, tmp_path):
+        # ARRANGE
+        (tmp_path / "definition.json").write_text(
+            json.dumps(
+                {
+                    "name": "test",
+                    "states": [{"name": "draft"}, "archived"],
+                    "transitions": [
+                        {"trigger": "archive", "source": "*", "dest": "archived"},
+                        {"trigger": "touch", "source": "draft", "dest": "="},
+                    ],
+                }
+            )
+        )
+        # ACT
+        definition = StateMachineDefinition(entity=None, path=str(tmp_path))
+        # ASSERT
+        assert definition.state_triggers == {
+            "draft": ("archive", "touch"),
+            "archived": ("archive",),
+        }
+        assert definition.get_destination("touch", "draft") == "draft"
+
+    def test_available_transitions_match_machine(self, state_machine_model):
+        # ARRANGE
+        entities = [
+            state_machine_model(state=state)
+            for state in ["draft", "submitted", "approved", "rejected"]
+        ]
+        # ACT / ASSERT
+        for entity in entities:
+            assert set(entity.available_transitions) == set(
+                entity.machine.get_triggers(entity.state)
+            )
+
+
+class TestStateMachineQuerySet:
+    @pytest.fixture
+    def entities(self, db, state_machine_model):
+        return {
+            state: baker.make(state_machine_model, state=state)
+            for state in ["draft", "submitted", "approved", "rejected"]
+        }
+
+    def test_transitionable(
+        self, state_machine_model, entities, django_assert_num_queries
+    ):
+        # ACT
+        with django_assert_num_queries(2):
+            redraftable = set(
+                state_machine_model.objects.transitionable("redraft").values_list(
+                    "state", flat=True
+                )
+            )
+            approvable_count = state_machine_model.objects.transitionable(
+                "approve"
+            ).count()
+        # ASSERT
+        assert redraftable == {"submitted", "rejected"}
+        assert approvable_count == 1
+        assert not state_machine_model.objects.transitionable("missing").exists()
+
+    def test_with_available_triggers(self, state_machine_model, entities):
+        # ACT
+        available_triggers = dict(
+            state_machine_model.objects.with_available_triggers().values_list(
+                "state", "available_triggers"
+            )
+        )
+        # ASSERT
+        assert available_triggers == {
+            "draft": ["submit"],
+            "submitted": ["approve", "reject", "redraft"],
+            "approved": [],
+            "rejected": ["redraft"],
+        }
+
+    def test_definitions_by_type(self, tmp_path, state_machine_definition):
+        # ARRANGE
+        for name in ["entity_default", "entity_special", "entity_special_other"]:
+            (tmp_path / name).mkdir()
+            (tmp_path / name / "definition.json").write_text(
+                json.dumps(state_machine_definition)
+            )
+        registry = DefinitionRegistry()
+        # ACT
+        definitions = registry.get_by_type(f"{tmp_path}/entity_")
+        # ASSERT
+        assert set(definitions) == {"default", "special", "special_other"}
+
+    def test_definitions_of_models_sharing_prefix(
+        self,
+        settings,
+        tmp_path,
+        state_machine_definition,
+        test_typed_state_machine_model_class,
+    ):
+        # ARRANGE
+        settings.ROOT_DIR = str(tmp_path)
+        root = tmp_path / "django_extras" / "state_machine"
+        # `testtypedmodel_template` is another model sharing the name prefix
+        for name in [
+            "testtypedmodel_default",
+            "testtypedmodel_2",
+            "testtypedmodel_template_default",
+        ]:
+            (root / name).mkdir(parents=True)
+            (root / name / "definition.json").write_text(
+                json.dumps(state_machine_definition)
+            )
+        queryset = test_typed_state_machine_model_class.objects.all()
+        # ACT
+        conditions = [condition for condition, _ in queryset._definition_conditions()]
+        # ASSERT
+        assert conditions == [Q(type=2), ~Q(type__in=[2])]
+        assert "template_default" not in str(queryset.transitionable("submit").query)
+
+
+class TestBulkTransition:
+    def test_bulk_transition_results(
+        self, state_machine_model, state_machine_user, django_assert_max_num_queries
+    ):
+        # ARRANGE
+        drafts = baker.make(state_machine_model, state="draft", _quantity=5)
+        approved = baker.make(state_machine_model, state="approved")
+        queryset = state_machine_model.objects.order_by("id")
+        # ACT
+        with django_assert_max_num_queries(6):
+            results = state_machine_model.bulk_transition(
+                queryset, "submit", user_id=state_machine_user.pk
+            )
+        # ASSERT
+        assert [result.entity_id for result in results] == [
+            str(entity.pk) for entity in [*drafts, approved]
+        ]
+        assert all(result.success for result in results[:-1])
+        assert results[-1].error == TransitionResult.CONFLICT
+        assert list(queryset.values_list("state", "last_transition")) == [
+            *[("submitted", "submit")] * 5,
+            ("approved", ""),
+        ]
+
+    def test_bulk_transition_sends_signal_once(
+        self, state_machine_model, state_machine_user
+    ):
+        # ARRANGE
+        baker.make(state_machine_model, state="draft", _quantity=3)
+        receiver = Mock()
+        state_machine_model.post_bulk_transition.connect(receiver, weak=False)
+        # ACT
+        try:
+            state_machine_model.bulk_transition(
+                state_machine_model.objects.all(),
+                "submit",
+                user_id=state_machine_user.pk,
+            )
+        finally:
+            state_machine_model.post_bulk_transition.disconnect(receiver)
+        # ASSERT
+        receiver.assert_called_once()
+        assert len(receiver.call_args.kwargs["events"]) == 3
+
+    def test_bulk_transition_writes_fields_of_synchronous_actions(
+        self, db, monkeypatch, state_machine_model
+    ):
+        # ARRANGE
+        request_users = []
+
+        def submit(entity, request_user=None, **kwargs):
+            request_users.append(request_user)
+            entity.version = 7
+
+        entities = baker.make(state_machine_model, state="draft", _quantity=3)
+        definition = entities[0].machine_definition()
+        monkeypatch.setattr(
+            definition, "synchronous_actions_module", SimpleNamespace(submit=submit)
+        )
+        # ACT
+        results = state_machine_model.bulk_transition(
+            state_machine_model.objects.all(), "submit"
+        )
+        # ASSERT
+        assert all(result.success for result in results)
+        assert request_users == [None] * 3
+        assert set(
+            state_machine_model.objects.values_list(
+                "state", "last_transition", "version"
+            )
+        ) == {("submitted", "submit", 7)}
+
+    def test_can_transition_resolves_permission_once_per_scope(
+        self, settings, state_machine_model
+    ):
+        # ARRANGE
+        settings.AUTHZ_ACTIVE = True
+        user = MagicMock()
+        user.has_perm.return_value = True
+        perms_cache = dict()
+        entities = [state_machine_model(state="submitted") for _ in range(3)]
+        transition = entities[0].machine.events["approve"].transitions["submitted"][0]
+        # ACT
+        for entity in entities:
+            entity._transition_user = user
+            entity._transition_perms_cache = perms_cache
+            assert entity.can_transition(transition)
+        # ASSERT
+        user.has_perm.assert_called_once_with("accounts.approve")
+
+    def test_bulk_transition_in_batches(
+        self, mocker, monkeypatch, state_machine_model, state_machine_user
+    ):
+        # ARRANGE
+        entities = baker.make(state_machine_model, state="draft", _quantity=5)
+        bulk_transition = mocker.spy(state_machine_model, "bulk_transition")
+        # `sender` is located by its path
+        monkeypatch.setattr(
+            sys.modules[state_machine_model.__module__],
+            state_machine_model.__name__,
+            state_machine_model,
+            raising=False,
+        )
+        # ACT
+        results = state_machine_model.perform_bulk_transition(
+            sender=f"{state_machine_model.__module__}.{state_machine_model.__name__}",
+            entity_ids=[str(entity.pk) for entity in entities],
+            transition_name="submit",
+            batch_size=2,
+            user_id=str(state_machine_user.pk),
+        )
+        # ASSERT
+        assert bulk_transition.call_count == 3
+        assert [result["entity_id"] for result in results] == [
+            str(entity.pk) for entity in entities
+        ]
+        assert all(result["success"] for result in results)
+
+
+class TestTransitionPermissionResolver:
+    @pytest.fixture
+    def resolver(self):
+        resolver = TransitionPermissionResolver(Mock())
+        resolver._group_codenames = [
+            frozenset({"state_machine_user_default", "approve"}),
+            frozenset({"reject"}),
+            frozenset({"redraft", "State_Machine_user_other"}),
+        ]
+        return resolver
+
+    @pytest.mark.parametrize(
+        "codenames, expected",
+        [(["approve"], True), (["reject"], False), (["redraft"], False)],
+    )
+    def test_global_groups_have_any(self, resolver, codenames, expected):
+        # ACT / ASSERT
+        assert (
+            resolver.global_groups_have_any("state_machine_user_default", codenames)
+            is expected
+        )
+
+    @pytest.mark.parametrize(
+        "codenames, expected",
+        [(["approve"], False), (["reject"], True), (["redraft"], False)],
+    )
+    def test_local_groups_have_any(self, resolver, codenames, expected):
+        # ACT / ASSERT
+        assert resolver.local_groups_have_any(codenames) is expected
+
+    def test_resolver_shared_within_scope(self, state_machine_user):
+        # ARRANGE
+        user_id = str(state_machine_user.pk)
+        # ACT
+        with permission_scope():
+            resolver = get_permission_resolver(user_id=user_id)
+            scoped_resolver = get_permission_resolver(user_id=user_id)
+        resolver_out_of_scope = get_permission_resolver(user_id=user_id)
+        # ASSERT
+        assert scoped_resolver is resolver
+        assert resolver_out_of_scope is not resolver
+
+    @pytest.fixture
+    def user_groups(self, db, settings, monkeypatch, state_machine_model):
+        """Entities of `state_machine_model` checked through the permission layer of
+        the user model, users belonging to a group with the global permission of the
+        state machine and `approve` and to a local group with `reject`"""
+        # group permission changes invalidate the cached permission versions
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+        content_type = ContentType.objects.get_for_model(state_machine_model)
+        groups = []
+        for codenames in [
+            ["state_machine_teststatemachinemodel_default", "approve"],
+            ["reject"],
+        ]:
+            group = Group.objects.create(name="|".join(codenames))
+            group.permissions.set(
+                Permission.objects.create(
+                    codename=codename, name=codename, content_type=content_type
+                )
+                for codename in codenames
+            )
+            groups.append(group)
+        monkeypatch.setattr(
+            "django_extras.state_machine.models.MODEL_USER",
+            SimpleNamespace(instance=state_machine_model),
+        )
+        # the user model has no groups of its own
+        monkeypatch.setattr(
+            MODEL_USER.instance,
+            "groups",
+            property(lambda user: Group.objects.filter(pk__in=[g.pk for g in groups])),
+            raising=False,
+        )
+        return groups
+
+    def test_can_transition_queries_constant_within_scope(
+        self, settings, state_machine_model, state_machine_user, user_groups
+    ):
+        # ARRANGE
+        settings.AUTHZ_ACTIVE = True
+        user_id = str(state_machine_user.pk)
+        transitions = state_machine_model(state="submitted").machine.events
+        approve = transitions["approve"].transitions["submitted"][0]
+        reject = transitions["reject"].transitions["submitted"][0]
+
+        def check(n_entities):
+            entities = [
+                state_machine_model(pk=pk, state="submitted")
+                for pk in range(1, n_entities + 1)
+            ]
+            for entity in entities:
+                entity.type = "default"
+            with permission_scope(), CaptureQueriesContext(connection) as queries:
+                allowed = {
+                    (
+                        entity.can_transition(approve, user_id=user_id),
+                        entity.can_transition(reject, user_id=user_id),
+                    )
+                    for entity in entities
+                }
+            return allowed, len(queries)
+
+        # ACT
+        allowed_few, num_queries_few = check(2)
+        allowed_many, num_queries_many = check(20)
+        # ASSERT
+        assert allowed_few == allowed_many == {(True, False)}
+        # the user and the permissions of its groups
+        assert num_queries_few == num_queries_many == 2
+
+
+class TestUserTransitionsApi:
+    @pytest.fixture(autouse=True)
+    def locmem_cache(self, settings):
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+
+    @pytest.fixture
+    def user(self):
+        return Mock(
+            pk=1,
+            is_active=True,
+            is_superuser=False,
+            get_all_permissions=Mock(
+                return_value={"django_extras.transition_teststatemachinemodel_submit"}
+            ),
+        )
+
+    def test_transitions_api_of_user(self, state_machine_model, user):
+        # ARRANGE
+        transitions_cls = state_machine_model.transitions_cls
+        # ACT
+        transitions_api = transitions_cls.transitions_api(user=user)
+        # ASSERT
+        assert transitions_api == {"submit": "submit"}
+        assert transitions_cls.transitions_api(user=user, as_str="|") == "submit"
+        user.get_all_permissions.assert_called_once()
+
+    def test_transitions_api_invalidated(self, state_machine_model, user):
+        # ARRANGE
+        transitions_cls = state_machine_model.transitions_cls
+        transitions_cls.transitions_api(user=user)
+        user.get_all_permissions.return_value = set()
+        # ACT
+        cached_transitions_api = transitions_cls.transitions_api(user=user)
+        invalidate_permission_version([user.pk])
+        transitions_api = transitions_cls.transitions_api(user=user)
+        # ASSERT
+        assert cached_transitions_api == {"submit": "submit"}
+        assert transitions_api == {}
+
+    def test_transitions_api_of_superuser(self, state_machine_model, user):
+        # ARRANGE
+        user.is_superuser = True
+        # ACT / ASSERT
+        assert state_machine_model.transitions_cls.transitions_api(user=user) == {
+            "submit": "submit",
+            "approve": "approve",
+            "reject": "reject",
+            "redraft": "redraft",
+        }
+
+    def test_group_permissions_change_invalidates(self, db, user):
+        # ARRANGE
+        group = Group.objects.create(name="group")
+        version = get_permission_version(user)
+        # ACT
+        group.permissions.add(Permission.objects.first())
+        # ASSERT
+        assert get_permission_version(user) != version
+
+
+class TestAvailableTransitionsFor:
+    @pytest.fixture
+    def authz_user(self, settings):
+        settings.AUTHZ_ACTIVE = True
+        user = MagicMock()
+        user.has_perm.return_value = False
+        return user
+
+    def test_available_transitions_for_groups_permissions(
+        self, state_machine_model, authz_user
+    ):
+        # ARRANGE
+        entities = [
+            state_machine_model(pk=pk, state=state)
+            for pk, state in enumerate(["draft", "submitted", "submitted"])
+        ]
+        # ACT
+        available_transitions = state_machine_model.available_transitions_for(
+            entities, user=authz_user
+        )
+        # ASSERT
+        assert available_transitions == {
+            "0": {"submit": {}},
+            "1": {"reject": {}, "redraft": {}},
+            "2": {"reject": {}, "redraft": {}},
+        }
+        authz_user.has_perm.assert_called_once_with("accounts.approve")
+        assert entities[1].available_transitions == available_transitions["1"]
+
+    def test_available_transitions_for_users_of_entities(
+        self, state_machine_model, authz_user
+    ):
+        # ARRANGE
+        approver = MagicMock(pk=2)
+        approver.has_perm.return_value = True
+        entities = [state_machine_model(pk=pk, state="submitted") for pk in range(2)]
+        entities[0]._transition_user = authz_user
+        entities[1]._transition_user = approver
+        # ACT
+        available_transitions = state_machine_model.available_transitions_for(entities)
+        # ASSERT
+        assert available_transitions == {
+            "0": {"reject": {}, "redraft": {}},
+            "1": {"approve": {}, "reject": {}, "redraft": {}},
+        }
+
+    def test_available_transitions_field_batches_list(
+        self, mocker, state_machine_model, authz_user
+    ):
+        # ARRANGE
+        class EntitySerializer(serializers.Serializer):
+            state = serializers.CharField()
+            available_transitions = AvailableTransitionsField()
+
+        entities = [state_machine_model(pk=pk, state="submitted") for pk in range(3)]
+        request = Mock(user=authz_user)
+        available_transitions_for = mocker.spy(
+            state_machine_model, "available_transitions_for"
+        )
+        # ACT
+        data = EntitySerializer(entities, many=True, context={"request": request}).data
+        # ASSERT
+        available_transitions_for.assert_called_once()
+        assert [entity["available_transitions"] for entity in data] == [
+            {"reject": {}, "redraft": {}}
+        ] * 3
+
+
+class TestBackgroundActionOutbox:
+    @pytest.fixture
+    def outbox_model(
+        self, db, monkeypatch, state_machine_model, test_background_action_outbox_class
+    ):
+        monkeypatch.setattr(
+            state_machine_model,
+            "background_action_outbox",
+            ClassRef(
+                test_background_action_outbox_class._meta.label, django_native=True
+            ),
+        )
+        return test_background_action_outbox_class
+
+    @pytest.fixture
+    def background_actions(self, monkeypatch, state_machine_model):
+        actions = Mock()
+        definition = state_machine_model(state="draft").machine_definition()
+        monkeypatch.setattr(
+            definition,
+            "background_actions_module",
+            SimpleNamespace(submit=actions.submit, redraft=actions.redraft),
+        )
+        return actions
+
+    def test_transitions_relayed_once_on_commit(
+        self,
+        mocker,
+        django_capture_on_commit_callbacks,
+        state_machine_model,
+        state_machine_user,
+        outbox_model,
+        background_actions,
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="draft")
+        delay = mocker.patch.object(outbox.perform_outbox_background_actions, "delay")
+        user_id = str(state_machine_user.pk)
+        # ACT
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                entity.trigger("submit", user_id=user_id)
+                entity.trigger("redraft", user_id=user_id)
+                entity.trigger("submit", user_id=user_id)
+                # not relayed before the transaction is committed
+                delay.assert_not_called()
+        # ASSERT
+        actions = list(outbox_model.objects.order_by("pk"))
+        assert [action.transition_name for action in actions] == [
+            "submit",
+            "redraft",
+            "submit",
+        ]
+        assert all(action.dispatched for action in actions)
+        assert len([c for c in callbacks if getattr(c, "outbox", None)]) == 1
+        delay.assert_called_once_with(
+            outbox=outbox_model._meta.label, ids=[action.pk for action in actions]
+        )
+        background_actions.submit.assert_not_called()
+
+    def test_transition_without_background_action_skips_outbox(
+        self, state_machine_model, state_machine_user, outbox_model, background_actions
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="submitted")
+        # ACT
+        entity.trigger("reject", user_id=str(state_machine_user.pk))
+        # ASSERT
+        assert not outbox_model.objects.exists()
+
+    def test_transactions_relayed_once_per_coalesce_window(
+        self,
+        mocker,
+        monkeypatch,
+        settings,
+        django_capture_on_commit_callbacks,
+        state_machine_model,
+        state_machine_user,
+        outbox_model,
+        background_actions,
+    ):
+        # ARRANGE
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+        monkeypatch.setattr(outbox_model, "coalesce_window", timedelta(seconds=5))
+        entity = baker.make(state_machine_model, state="draft")
+        apply_async = mocker.patch.object(
+            outbox.relay_background_actions, "apply_async"
+        )
+        user_id = str(state_machine_user.pk)
+        # ACT
+        for transition_name in ["submit", "redraft", "submit"]:
+            with django_capture_on_commit_callbacks(execute=True):
+                with transaction.atomic():
+                    entity.trigger(transition_name, user_id=user_id)
+        # ASSERT
+        apply_async.assert_called_once_with(
+            kwargs={"outbox": outbox_model._meta.label}, countdown=5.0
+        )
+        assert outbox_model.objects.filter(dispatched__isnull=True).count() == 3
+
+    def test_relay_batches_entities(
+        self,
+        mocker,
+        state_machine_model,
+        outbox_model,
+        django_capture_on_commit_callbacks,
+    ):
+        # ARRANGE
+        delay = mocker.patch.object(outbox.perform_outbox_background_actions, "delay")
+        actions = outbox_model.objects.bulk_create(
+            outbox_model(
+                sender=state_machine_model._meta.label,
+                entity_id=entity_id,
+                transition_name="submit",
+                source="draft",
+                target="submitted",
+            )
+            for entity_id in ["1", "2", "1", "3"]
+        )
+        # ACT
+        with django_capture_on_commit_callbacks(execute=True):
+            dispatched = outbox.relay(outbox_model, batch_size=2)
+        # ASSERT
+        assert dispatched == 4
+        assert [c.kwargs["ids"] for c in delay.call_args_list] == [
+            [actions[0].pk, actions[2].pk, actions[1].pk],
+            [actions[3].pk],
+        ]
+        assert outbox.relay(outbox_model) == 0
+
+    def test_relay_failure_does_not_fail_transition(
+        self,
+        mocker,
+        django_capture_on_commit_callbacks,
+        state_machine_model,
+        state_machine_user,
+        outbox_model,
+        background_actions,
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="draft")
+        mocker.patch.object(
+            outbox.perform_outbox_background_actions,
+            "delay",
+            side_effect=ConnectionError("broker unavailable"),
+        )
+        # ACT
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                assert entity.trigger("submit", user_id=str(state_machine_user.pk))
+        # ASSERT
+        assert state_machine_model.objects.get(pk=entity.pk).state == "submitted"
+        # dispatched by the next relay
+        assert outbox_model.objects.get().dispatched is None
+
+    def test_relay_marks_sent_batches_dispatched(
+        self, mocker, state_machine_model, outbox_model
+    ):
+        # ARRANGE
+        delay = mocker.patch.object(
+            outbox.perform_outbox_background_actions,
+            "delay",
+            side_effect=[None, ConnectionError("broker unavailable")],
+        )
+        actions = outbox_model.objects.bulk_create(
+            outbox_model(
+                sender=state_machine_model._meta.label,
+                entity_id=entity_id,
+                transition_name="submit",
+                source="draft",
+                target="submitted",
+            )
+            for entity_id in ["1", "2", "3"]
+        )
+        # ACT
+        dispatched = outbox.relay(outbox_model, batch_size=2)
+        # ASSERT
+        assert dispatched == 2
+        assert delay.call_count == 2
+        assert [
+            action.dispatched is not None
+            for action in outbox_model.objects.order_by("pk")
+        ] == [True, True, False]
+        assert outbox_model.objects.get(dispatched__isnull=True).pk == actions[2].pk
+
+    def test_perform_outbox_background_actions_isolates_failures(
+        self,
+        state_machine_model,
+        outbox_model,
+        background_actions,
+    ):
+        # ARRANGE
+        def submit(instance, entity, **kwargs):
+            if entity.pk == entities[1].pk:
+                raise ValueError("failed")
+            entity.last_transition = "background"
+
+        entities = baker.make(state_machine_model, state="draft", _quantity=3)
+        background_actions.submit.side_effect = submit
+        actions = outbox_model.objects.bulk_create(
+            outbox_model(
+                sender=state_machine_model._meta.label,
+                entity_id=str(entity.pk),
+                transition_name="submit",
+                source="draft",
+                target="submitted",
+            )
+            for entity in entities
+        )
+        # ACT
+        outbox.perform_outbox_background_actions(
+            outbox=outbox_model._meta.label, ids=[action.pk for action in actions]
+        )
+        # ASSERT
+        assert background_actions.submit.call_count == 3
+        assert list(outbox_model.objects.values_list("pk", flat=True)) == [
+            actions[1].pk
+        ]
+        assert list(
+            state_machine_model.objects.order_by("pk").values_list(
+                "last_transition", flat=True
+            )
+        ) == ["background", "", "background"]
+
+    def test_perform_outbox_background_actions(
+        self,
+        state_machine_model,
+        state_machine_user,
+        outbox_model,
+        background_actions,
+        django_assert_max_num_queries,
+    ):
+        # ARRANGE
+        entities = baker.make(state_machine_model, state="draft", _quantity=2)
+        actions = outbox_model.objects.bulk_create(
+            outbox_model(
+                sender=state_machine_model._meta.label,
+                entity_id=str(entity.pk),
+                transition_name=transition_name,
+                source="draft",
+                target="submitted",
+                request_user_id=str(state_machine_user.pk),
+            )
+            for entity in entities
+            for transition_name in ["submit", "redraft"]
+        )
+        # ACT
+        # outbox, users, entities then a transaction saving each entity once
+        with django_assert_max_num_queries(3 + 4 * len(entities)):
+            outbox.perform_outbox_background_actions(
+                outbox=outbox_model._meta.label, ids=[action.pk for action in actions]
+            )
+        # ASSERT
+        assert not outbox_model.objects.exists()
+        assert [c[0] for c in background_actions.mock_calls] == [
+            "submit",
+            "redraft",
+        ] * len(entities)
+        assert background_actions.submit.call_args_list[0] == call(
+            entities[0],
+            sender=f"{state_machine_model.__module__}.{state_machine_model.__name__}",
+            entity_id=str(entities[0].pk),
+            transition_name="submit",
+            source="draft",
+            target="submitted",
+            request_user_id=str(state_machine_user.pk),
+            data={},
+            request_user=state_machine_user,
+            entity=entities[0],
+        )
+
+
+class TestStateMachineViewMixin:
+    @pytest.fixture
+    def viewset_factory(self, state_machine_model):
+        class TransitionSerializer(serializers.ModelSerializer):
+            def __init__(self, *args, return_nested_data=False, **kwargs):
+                super().__init__(*args, **kwargs)
+
+            class Meta:
+                model = state_machine_model
+                fields = ["id", "state", "last_transition", "version"]
+
+        def factory(refresh_fields=(), bulk_kwargs=None, **transition_kwargs):
+            class TransitionViewSet(StateMachineViewMixin, viewsets.GenericViewSet):
+                queryset = state_machine_model.objects.all()
+                serializer_class = TransitionSerializer
+                filter_backends = []
+                transition_refresh_fields = refresh_fields
+                transition = StateMachineViewMixin.generate_transition_method(
+                    state_machine_model.objects.all(), **transition_kwargs
+                )
+                bulk_transition = StateMachineViewMixin.generate_bulk_transition_method(
+                    state_machine_model.objects.all(), **(bulk_kwargs or {})
+                )
+
+            return TransitionViewSet
+
+        return factory
+
+    @pytest.fixture
+    def post_transition(self, state_machine_user):
+        def post(viewset, entity, name, user=state_machine_user, **headers):
+            request = APIRequestFactory().post(
+                f"/{entity.pk}/transition/{name}/", **headers
+            )
+            force_authenticate(request, user=user)
+            return viewset.as_view({"post": "transition"})(
+                request, pk=entity.pk, name=name
+            )
+
+        return post
+
+    @pytest.fixture
+    def post_bulk_transition(self, state_machine_user):
+        def post(viewset, name, data, user=state_machine_user):
+            request = APIRequestFactory().post(
+                f"/bulk_transition/{name}/", data, format="json"
+            )
+            if user is not None:
+                force_authenticate(request, user=user)
+            # with the permission classes of the action, as routers
+            return viewset.as_view(
+                {"post": "bulk_transition"}, **viewset.bulk_transition.kwargs
+            )(request, name=name)
+
+        return post
+
+    @pytest.fixture
+    def version_updated_after_transition(self, state_machine_model):
+        def receiver(sender, entity_id, **kwargs):
+            state_machine_model.objects.filter(pk=entity_id).update(version=7)
+
+        state_machine_model.post_transition.connect(receiver, weak=False)
+        yield
+        state_machine_model.post_transition.disconnect(receiver)
+
+    def test_transition_serializes_transitioned_object(
+        self, mocker, state_machine_model, viewset_factory, post_transition
+    ):
+        # ARRANGE
+        viewset = viewset_factory()
+        entity = baker.make(state_machine_model, state="draft")
+        get_object = mocker.spy(viewset, "get_object")
+        # ACT
+        response = post_transition(viewset, entity, "submit")
+        # ASSERT
+        assert response.status_code == 200
+        assert response.data["state"] == "submitted"
+        assert response.data["last_transition"] == "submit"
+        get_object.assert_called_once()
+
+    def test_transition_refreshes_fields(
+        self,
+        state_machine_model,
+        viewset_factory,
+        post_transition,
+        version_updated_after_transition,
+    ):
+        # ARRANGE
+        entity = baker.make(state_machine_model, state="draft")
+        # ACT
+        stale = post_transition(viewset_factory(), entity, "submit")
+        refreshed = post_transition(
+            viewset_factory(refresh_fields=("version",)), entity, "redraft"
+        )
+        # ASSERT
+        assert stale.data["version"] == 0
+        assert refreshed.data["version"] == 7
+        assert refreshed.data["state"] == "draft"
+
+    def test_transition_writes_fields_modified_by_receivers(
+        self, state_machine_model, viewset_factory, post_transition
+    ):
+        # ARRANGE
+        def receiver(sender, instance, **kwargs):
+            instance.version = 42
+
+        entity = baker.make(state_machine_model, state="draft")
+        state_machine_model.post_transition.connect(receiver)
+        # ACT
+        try:
+            response = post_transition(viewset_factory(), entity, "submit")
+        finally:
+            state_machine_model.post_transition.disconnect(receiver)
+        # ASSERT
+        assert response.data["version"] == 42
+        assert state_machine_model.objects.get(pk=entity.pk).version == 42
+
+    def test_transition_full_reload(
+        self,
+        mocker,
+        state_machine_model,
+        viewset_factory,
+        post_transition,
+        version_updated_after_transition,
+    ):
+        # ARRANGE
+        viewset = viewset_factory(transition_full_reload=True)
+        entity = baker.make(state_machine_model, state="draft")
+        get_object = mocker.spy(viewset, "get_object")
+        # ACT
+        response = post_transition(viewset, entity, "submit")
+        # ASSERT
+        assert response.data["version"] == 7
+        assert get_object.call_count == 2
+
+    def test_bulk_transition_item_results(
+        self, state_machine_model, viewset_factory, post_bulk_transition
+    ):
+        # ARRANGE
+        drafts = baker.make(state_machine_model, state="draft", _quantity=2)
+        approved = baker.make(state_machine_model, state="approved")
+        ids = [entity.pk for entity in [*drafts, approved]] + [approved.pk + 1]
+        # ACT
+        response = post_bulk_transition(
+            viewset_factory(bulk_kwargs={"batch_size": 2}), "submit", {"ids": ids}
+        )
+        # ASSERT
+        assert response.status_code == 200
+        assert [(r["id"], r["status"]) for r in response.data["results"]] == [
+            (str(drafts[0].pk), 200),
+            (str(drafts[1].pk), 200),
+            (str(approved.pk), 409),
+            (str(approved.pk + 1), 404),
+        ]
+        assert list(
+            state_machine_model.objects.order_by("pk").values_list("state", flat=True)
+        ) == ["submitted", "submitted", "approved"]
+
+    @pytest.mark.parametrize("background_threshold", [None, 0])
+    def test_bulk_transition_checks_object_permissions(
+        self,
+        mocker,
+        django_capture_on_commit_callbacks,
+        state_machine_model,
+        viewset_factory,
+        post_bulk_transition,
+        background_threshold,
+    ):
+        # ARRANGE
+        class IsNotVersioned(permissions.BasePermission):
+            message = "Versioned entities can't be transitioned"
+
+            def has_object_permission(self, request, view, obj):
+                return obj.version == 0
+
+        entities = baker.make(state_machine_model, state="draft", _quantity=3)
+        state_machine_model.objects.filter(pk=entities[1].pk).update(version=1)
+        apply_async = mocker.patch.object(
+            state_machine_model.perform_bulk_transition, "apply_async"
+        )
+        viewset = viewset_factory(
+            bulk_kwargs={
+                "transition_permission_classes": [IsNotVersioned],
+                "background_threshold": background_threshold,
+            }
+        )
+        # ACT
+        with django_capture_on_commit_callbacks(execute=True):
+            response = post_bulk_transition(viewset, "submit", {})
+        # ASSERT
+        items = {r["id"]: r for r in response.data["results"]}
+        assert items[str(entities[1].pk)]["status"] == 403
+        assert items[str(entities[1].pk)]["detail"] == IsNotVersioned.message
+        if background_threshold is None:
+            assert [r["status"] for r in response.data["results"]] == [200, 403, 200]
+            assert list(
+                state_machine_model.objects.order_by("pk").values_list(
+                    "state", flat=True
+                )
+            ) == ["submitted", "draft", "submitted"]
+        else:
+            task_kwargs = apply_async.call_args.kwargs["kwargs"]
+            assert task_kwargs["entity_ids"] == [
+                str(entities[0].pk),
+                str(entities[2].pk),
+            ]
+
+    @pytest.mark.parametrize("background_threshold", [None, 0])
+    def test_bulk_transition_checks_permissions_of_anonymous_user(
+        self,
+        mocker,
+        monkeypatch,
+        settings,
+        django_capture_on_commit_callbacks,
+        state_machine_model,
+        viewset_factory,
+        post_bulk_transition,
+        background_threshold,
+    ):
+        # ARRANGE
+        settings.AUTHZ_ACTIVE = True
+        entities = baker.make(state_machine_model, state="submitted", _quantity=2)
+        # `sender` of the background task is located by its path
+        monkeypatch.setattr(
+            sys.modules[state_machine_model.__module__],
+            state_machine_model.__name__,
+            state_machine_model,
+            raising=False,
+        )
+        apply_async = mocker.patch.object(
+            state_machine_model.perform_bulk_transition, "apply_async"
+        )
+        viewset = viewset_factory(
+            bulk_kwargs={"background_threshold": background_threshold}
+        )
+        # ACT
+        with django_capture_on_commit_callbacks(execute=True):
+            response = post_bulk_transition(
+                viewset, "approve", {"ids": [e.pk for e in entities]}, user=None
+            )
+        if background_threshold is not None:
+            results = state_machine_model.perform_bulk_transition(
+                **apply_async.call_args.kwargs["kwargs"]
+            )
+        # ASSERT
+        if background_threshold is None:
+            assert [r["status"] for r in response.data["results"]] == [403, 403]
+        else:
+            assert response.status_code == 202
+            assert [r["error"] for r in results] == [TransitionResult.DENIED] * 2
+        assert set(state_machine_model.objects.values_list("state", flat=True)) == {
+            "submitted"
+        }
+
+    def test_bulk_transition_writes_fields_of_synchronous_actions(
+        self, monkeypatch, state_machine_model, viewset_factory, post_bulk_transition
+    ):
+        # ARRANGE
+        def submit(entity, **kwargs):
+            entity.version = 7
+
+        entities = baker.make(state_machine_model, state="draft", _quantity=2)
+        monkeypatch.setattr(
+            entities[0].machine_definition(),
+            "synchronous_actions_module",
+            SimpleNamespace(submit=submit),
+        )
+        # ACT
+        response = post_bulk_transition(viewset_factory(), "submit", {})
+        # ASSERT
+        assert response.status_code == 200
+        assert set(state_machine_model.objects.values_list("state", "version")) == {
+            ("submitted", 7)
+        }
+
+    def test_bulk_transition_invalid_ids(self, viewset_factory, post_bulk_transition):
+        # ACT
+        response = post_bulk_transition(viewset_factory(), "submit", {"ids": ["a"]})
+        # ASSERT
+        assert response.status_code == 400
+
+    def test_bulk_transition_in_background(
+        self,
+        mocker,
+        django_capture_on_commit_callbacks,
+        state_machine_model,
+        state_machine_user,
+        viewset_factory,
+        post_bulk_transition,
+    ):
+        # ARRANGE
+        entities = baker.make(state_machine_model, state="draft", _quantity=3)
+        apply_async = mocker.patch.object(
+            state_machine_model.perform_bulk_transition, "apply_async"
+        )
+        viewset = viewset_factory(bulk_kwargs={"background_threshold": 2})
+        # ACT
+        with django_capture_on_commit_callbacks(execute=True):
+            response = post_bulk_transition(viewset, "submit", {})
+        # ASSERT
+        assert response.status_code == 202
+        assert response.data["count"] == 3
+        apply_async.assert_called_once()
+        assert apply_async.call_args.kwargs["task_id"] == response.data["job_id"]
+        task_kwargs = apply_async.call_args.kwargs["kwargs"]
+        assert task_kwargs["entity_ids"] == [str(entity.pk) for entity in entities]
+        assert task_kwargs["user_id"] == str(state_machine_user.pk)
+        assert not state_machine_model.objects.filter(state="submitted").exists()
+
+    @pytest.fixture
+    def locmem_cache(self, settings):
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+
+    def test_transition_idempotency_key_replays_response(
+        self,
+        mocker,
+        locmem_cache,
+        state_machine_model,
+        viewset_factory,
+        post_transition,
+        django_assert_num_queries,
+    ):
+        # ARRANGE
+        viewset = viewset_factory()
+        entity = baker.make(state_machine_model, state="draft")
+        trigger = mocker.spy(state_machine_model, "trigger")
+        first = post_transition(viewset, entity, "submit", HTTP_IDEMPOTENCY_KEY="k1")
+        # ACT
+        with django_assert_num_queries(0):
+            retry = post_transition(
+                viewset, entity, "submit", HTTP_IDEMPOTENCY_KEY="k1"
+            )
+        other = post_transition(viewset, entity, "submit", HTTP_IDEMPOTENCY_KEY="k2")
+        # ASSERT
+        assert first.status_code == retry.status_code == 200
+        assert retry.data == first.data
+        assert retry["Idempotent-Replayed"] == "true"
+        assert other.status_code == 409
+        trigger.assert_called_once()
+
+    def test_transition_idempotency_key_per_user(
+        self, locmem_cache, state_machine_model, viewset_factory, post_transition
+    ):
+        # ARRANGE
+        viewset = viewset_factory()
+        entity = baker.make(state_machine_model, state="draft")
+        other_user = baker.make(MODEL_USER.instance)
+        post_transition(viewset, entity, "submit", HTTP_IDEMPOTENCY_KEY="k1")
+        # ACT
+        response = post_transition(
+            viewset, entity, "submit", user=other_user, HTTP_IDEMPOTENCY_KEY="k1"
+        )
+        # ASSERT
+        assert response.status_code == 409
+        assert "Idempotent-Replayed" not in response
+
+    def test_transition_idempotency_key_ignored_for_anonymous_users(
+        self, locmem_cache, state_machine_model, viewset_factory, post_transition
+    ):
+        # ARRANGE
+        viewset = viewset_factory()
+        entity = baker.make(state_machine_model, state="draft")
+        first = post_transition(
+            viewset, entity, "submit", user=None, HTTP_IDEMPOTENCY_KEY="k1"
+        )
+        # ACT
+        response = post_transition(
+            viewset, entity, "submit", user=None, HTTP_IDEMPOTENCY_KEY="k1"
+        )
+        # ASSERT
+        assert first.status_code == 200
+        assert response.status_code == 409
+        assert "Idempotent-Replayed" not in response
+
+    def test_transition_idempotency_key_in_progress(
+        self,
+        locmem_cache,
+        state_machine_model,
+        state_machine_user,
+        viewset_factory,
+        post_transition,
+    ):
+        # ARRANGE
+        viewset = viewset_factory()
+        entity = baker.make(state_machine_model, state="draft")
+        request = APIRequestFactory().post(
+            f"/{entity.pk}/transition/submit/", HTTP_IDEMPOTENCY_KEY="k1"
+        )
+        request.user = state_machine_user
+        cache.add(viewset().get_idempotency_cache_key(request), "in_progress")
+        # ACT
+        response = post_transition(viewset, entity, "submit", HTTP_IDEMPOTENCY_KEY="k1")
+        # ASSERT
+        assert response.status_code == 409
+        entity.refresh_from_db()
+        assert entity.state == "draft"
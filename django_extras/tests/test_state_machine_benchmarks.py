@@ -0,0 +1,210 @@
+import json
+import sys
+from copy import deepcopy
+from types import SimpleNamespace
+
+import pytest
+from model_bakery import baker
+from rest_framework import serializers, viewsets
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ..config.models_foreign import MODEL_USER
+from ..state_machine.permissions import permission_scope
+from ..state_machine.registry import machine_registry
+from ..state_machine.views import StateMachineViewMixin
+
+# Baselines are stored in test_state_machine_benchmarks.json, see `BenchmarkRunner`
+
+# conditional triggers from the draft state added to the test definition
+BENCHMARK_TRIGGERS = 50
+
+
+@pytest.fixture(scope="module")
+def benchmark_root_dir(tmp_path_factory, state_machine_definition):
+    definition = deepcopy(state_machine_definition)
+    definition["transitions"] += [
+        {
+            "trigger": f"review_{i}",
+            "source": "draft",
+            "dest": "submitted",
+            "conditions": ["is_reviewable"],
+        }
+        for i in range(BENCHMARK_TRIGGERS)
+    ]
+    root_dir = tmp_path_factory.mktemp("benchmark_root_dir")
+    path = (
+        root_dir / "django_extras" / "state_machine" / "teststatemachinemodel_default"
+    )
+    path.mkdir(parents=True)
+    (path / "definition.json").write_text(json.dumps(definition))
+    return root_dir
+
+
+@pytest.fixture
+def benchmark_model(
+    monkeypatch,
+    state_machine_settings,
+    benchmark_root_dir,
+    test_state_machine_model_class,
+):
+    state_machine_settings.ROOT_DIR = str(benchmark_root_dir)
+    machine_registry.discard()
+    monkeypatch.setattr(
+        test_state_machine_model_class,
+        "is_reviewable",
+        lambda self, event_data: True,
+        raising=False,
+    )
+    yield test_state_machine_model_class
+    machine_registry.discard()
+
+
+@pytest.fixture
+def benchmark_user(db, monkeypatch):
+    # permissions of the legacy standard, see `_has_transition_permission`
+    monkeypatch.setattr(
+        MODEL_USER.instance,
+        "has_perm",
+        lambda self, perm, obj=None: True,
+        raising=False,
+    )
+    return baker.make(MODEL_USER.instance)
+
+
+@pytest.fixture
+def transition_view(benchmark_model):
+    class BenchmarkSerializer(serializers.ModelSerializer):
+        def __init__(self, *args, return_nested_data=False, **kwargs):
+            super().__init__(*args, **kwargs)
+
+        class Meta:
+            model = benchmark_model
+            fields = ["id", "state", "last_transition"]
+
+    class BenchmarkViewSet(StateMachineViewMixin, viewsets.GenericViewSet):
+        queryset = benchmark_model.objects.all()
+        serializer_class = BenchmarkSerializer
+        filter_backends = []
+        transition = StateMachineViewMixin.generate_transition_method(
+            benchmark_model.objects.all()
+        )
+
+    return BenchmarkViewSet.as_view({"post": "transition"})
+
+
+class TestStateMachineBenchmarks:
+    def test_create_machine(self, benchmark_runner, benchmark_model):
+        # ARRANGE
+        entities = [benchmark_model(state="draft") for _ in range(1000)]
+        # ACT
+        benchmark_runner("create_machine", lambda e: e.create_machine(), entities)
+        # ASSERT
+        assert len({id(entity.machine) for entity in entities}) == 1
+
+    def test_compile_machine(self, benchmark_runner, benchmark_model):
+        # ARRANGE
+        definition = benchmark_model(state="draft").machine_definition()
+        # ACT / ASSERT
+        benchmark_runner(
+            "compile_machine",
+            lambda _: benchmark_model.compile_machine(definition),
+            range(20),
+        )
+
+    def test_available_transitions(self, benchmark_runner, benchmark_model):
+        # ARRANGE
+        entities = [benchmark_model(state="draft") for _ in range(200)]
+        # ACT
+        benchmark_runner(
+            f"available_transitions[{BENCHMARK_TRIGGERS}]",
+            lambda e: e.available_transitions,
+            entities,
+        )
+        # ASSERT
+        assert len(entities[0].available_transitions) == BENCHMARK_TRIGGERS + 1
+
+    def test_can_transition_authz(
+        self, settings, benchmark_runner, benchmark_model, benchmark_user
+    ):
+        # ARRANGE
+        settings.AUTHZ_ACTIVE = True
+        entities = [benchmark_model(state="submitted") for _ in range(1000)]
+        transition = entities[0].machine.events["approve"].transitions["submitted"][0]
+        # ACT
+        with permission_scope():
+            benchmark_runner(
+                "can_transition[AUTHZ_ACTIVE]",
+                lambda e: e.can_transition(transition, user_id=benchmark_user.pk),
+                entities,
+            )
+        # ASSERT
+        assert all(entity._transition_user == benchmark_user for entity in entities)
+
+    def test_transition_view(
+        self,
+        settings,
+        benchmark_runner,
+        benchmark_model,
+        benchmark_user,
+        transition_view,
+    ):
+        # ARRANGE
+        settings.AUTHZ_ACTIVE = True
+        entities = baker.make(benchmark_model, state="draft", _quantity=100)
+        factory = APIRequestFactory()
+
+        def post(entity):
+            request = factory.post(f"/{entity.pk}/transition/submit/")
+            force_authenticate(request, user=benchmark_user)
+            # as `PermissionScopeMiddleware`
+            with permission_scope():
+                response = transition_view(request, pk=entity.pk, name="submit")
+            assert response.status_code == 200, response.data
+
+        # ACT
+        benchmark_runner("transition_view[submit]", post, entities)
+        # ASSERT
+        assert set(benchmark_model.objects.values_list("state", flat=True)) == {
+            "submitted"
+        }
+
+    def test_perform_background_action_eager(
+        self, monkeypatch, benchmark_runner, benchmark_model, benchmark_user
+    ):
+        # ARRANGE
+        def submit(instance, entity, **kwargs):
+            entity.last_transition = "background"
+
+        definition = benchmark_model(state="draft").machine_definition()
+        monkeypatch.setattr(
+            definition, "background_actions_module", SimpleNamespace(submit=submit)
+        )
+        # `sender` is located by its path
+        monkeypatch.setattr(
+            sys.modules[benchmark_model.__module__],
+            benchmark_model.__name__,
+            benchmark_model,
+            raising=False,
+        )
+        entities = baker.make(benchmark_model, state="submitted", _quantity=200)
+        # ACT
+        benchmark_runner(
+            "perform_background_action[eager]",
+            lambda e: benchmark_model.perform_background_action.apply(
+                kwargs={
+                    "sender": f"{benchmark_model.__module__}."
+                    f"{benchmark_model.__name__}",
+                    "entity_id": str(e.pk),
+                    "transition_name": "submit",
+                    "source": "draft",
+                    "target": "submitted",
+                    "request_user_id": str(benchmark_user.pk),
+                    "data": {},
+                }
+            ).get(),
+            entities,
+        )
+        # ASSERT
+        assert set(
+            benchmark_model.objects.values_list("last_transition", flat=True)
+        ) == {"background"}